@@ -1,52 +1,484 @@
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Blueprint, Flask, current_app, request, jsonify, send_file, make_response, g, has_request_context, \
+    stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import DeclarativeBase
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+from sqlalchemy import Select, TextClause, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import DeclarativeBase, defer, make_transient_to_detached, selectinload
 import os
 import datetime
 import logging
-from werkzeug.security import generate_password_hash, check_password_hash
+import json
+import base64
+import binascii
+import re
+import threading
+import atexit
+import queue
+import time
+import copy
+import random
+import gzip
+import zlib
+import io
+import csv
+import hashlib
+import heapq
+from urllib.parse import urlencode
+from collections import OrderedDict
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
+from werkzeug.local import LocalProxy
 from werkzeug.utils import secure_filename
 import jwt
+import click
 from datetime import datetime, timedelta
 from functools import wraps
 import uuid
+import shutil
+import mimetypes
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import quote
+from flask.json.provider import DefaultJSONProvider
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Set up logging (LOG_LEVEL: DEBUG, INFO, WARNING, ...)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 # Define SQLAlchemy base class
 class Base(DeclarativeBase):
     pass
 
-# Initialize Flask app and database
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+# Routes, request hooks and CLI commands are registered on this blueprint;
+# create_app() builds the Flask app and the per-app services around it
+api = Blueprint('api', __name__, cli_group=None)
 
-# Configure the database
-app.secret_key = os.environ.get("SESSION_SECRET", "dev_secret_key")
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///skillversity.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+def app_service(name):
+    """Proxy to the current app's instance of a service that create_app() sets up per app."""
+    return LocalProxy(lambda: current_app.extensions['skillversity'][name])
+
+# JSON provider. Encodes with orjson when it's installed, which is several
+# times faster on large catalog responses. The output matches Flask's default
+# provider: sorted keys, compact unless debugging, and the same rendering of
+# dates, UUIDs and decimals.
+class FastJSONProvider(DefaultJSONProvider):
+    ORJSON_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                      | orjson.OPT_PASSTHROUGH_DATACLASS) if orjson else 0
+    
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.ORJSON_OPTIONS).decode()
+    
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        options = self.ORJSON_OPTIONS
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            options |= orjson.OPT_INDENT_2
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=options) + b'\n',
+                                        mimetype=self.mimetype)
+
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+def wants_msgpack():
+    if msgpack is None:
+        return False
+    return request.accept_mimetypes.best_match(('application/json',) + MSGPACK_MIMETYPES) in MSGPACK_MIMETYPES
+
+def api_response(payload):
+    """Serialize a list endpoint's payload as JSON, or as MessagePack if the client asks for it."""
+    if wants_msgpack():
+        response = current_app.response_class(msgpack.packb(payload, default=current_app.json.default), mimetype='application/msgpack')
+    else:
+        response = jsonify(payload)
+    response.vary.add('Accept')
+    return response
 
-# Configure upload folder
+# Default storage locations. Course resources, blobs and media derivatives
+# live in subfolders of the configured UPLOAD_FOLDER.
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
-COURSE_RESOURCES_FOLDER = os.path.join(UPLOAD_FOLDER, 'course-resources')
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max upload
+UPLOAD_SESSIONS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'upload-sessions')
+
+# Course resource uploads are stored once per distinct content as
+# UPLOAD_FOLDER/blobs/<aa>/<sha256>, whatever the uploaded file was called.
+# Resource URLs add the original extension (/uploads/blobs/<aa>/<sha256><ext>),
+# which decides the served Content-Type; CourseResource.blob_hash references the blob.
+# Thumbnails, WebP variants and poster frames made by the media worker go to
+# UPLOAD_FOLDER/derivatives.
+COURSE_RESOURCES_SUBFOLDER = 'course-resources'
+BLOBS_SUBFOLDER = 'blobs'
+DERIVATIVES_SUBFOLDER = 'derivatives'
+MEDIA_IMAGE_WIDTHS = (320, 640, 1280)
+
+# Files with the generated "_<timestamp>_<uuid8>" suffix or a content hash name never change
+IMMUTABLE_MEDIA_MAX_AGE = 365 * 24 * 3600
+IMMUTABLE_UPLOAD_NAME = re.compile(r'(_\d{14}_[0-9a-f]{8}|^[0-9a-f]{64}(_\w+)?)(\.\w+)?$')
+
+def upload_subfolder(name):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], name)
+
+def load_config(config):
+    """Fill config with the settings below, read from the environment. create_app() applies its overrides on top."""
+    # Configure the database
+    config['SECRET_KEY'] = os.environ.get("SESSION_SECRET", "dev_secret_key")
+    config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///skillversity.db")
+    config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    
+    # Opt-in SQLite production profile: WAL journal, synchronous=NORMAL, memory-mapped
+    # I/O and a larger page cache on every connection, plus a single writer
+    # connection per process that takes the write lock up front (BEGIN IMMEDIATE),
+    # so writes queue instead of failing with "database is locked" and readers
+    # never wait for them. Ignored for other databases.
+    config['SQLITE_PERFORMANCE_MODE'] = os.environ.get("SQLITE_PERFORMANCE_MODE", "false").lower() == "true"
+    config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    config['SQLITE_CACHE_SIZE_KB'] = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "65536"))
+    config['SQLITE_MMAP_SIZE'] = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    
+    # Read replicas (comma-separated URLs). Endpoints marked @read_replica read from a
+    # replica; after a request writes, that client reads from the primary for
+    # READ_REPLICA_STICKY_SECONDS. A replica that fails to connect is skipped for
+    # READ_REPLICA_RETRY_SECONDS.
+    config['DATABASE_REPLICA_URLS'] = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(',') if url.strip()]
+    config['READ_REPLICA_STICKY_SECONDS'] = float(os.environ.get("READ_REPLICA_STICKY_SECONDS", "10"))
+    config['READ_REPLICA_RETRY_SECONDS'] = float(os.environ.get("READ_REPLICA_RETRY_SECONDS", "30"))
+    
+    # Connection pool per worker process. SQLALCHEMY_ENGINE_OPTIONS passed to
+    # create_app() take precedence over these.
+    config['DB_POOL_SIZE'] = int(os.environ.get("DB_POOL_SIZE", "5"))
+    config['DB_MAX_OVERFLOW'] = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+    config['DB_POOL_TIMEOUT'] = float(os.environ.get("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a connection
+    config['DB_POOL_RECYCLE'] = int(os.environ.get("DB_POOL_RECYCLE", "300"))
+    
+    # Configure upload folder
+    config['UPLOAD_FOLDER'] = os.environ.get("UPLOAD_FOLDER", UPLOAD_FOLDER)
+    config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max upload
+    
+    # Seconds between flushes of buffered course view counts (0 writes every view immediately)
+    config['VIEW_COUNT_FLUSH_INTERVAL'] = float(os.environ.get("VIEW_COUNT_FLUSH_INTERVAL", "5"))
+    
+    # Activity log events are written in batches of ACTIVITY_LOG_BATCH_SIZE or every
+    # ACTIVITY_LOG_FLUSH_MS milliseconds; events beyond ACTIVITY_LOG_QUEUE_SIZE are dropped
+    config['ACTIVITY_LOG_BATCH_SIZE'] = int(os.environ.get("ACTIVITY_LOG_BATCH_SIZE", "100"))
+    config['ACTIVITY_LOG_FLUSH_MS'] = int(os.environ.get("ACTIVITY_LOG_FLUSH_MS", "250"))
+    config['ACTIVITY_LOG_QUEUE_SIZE'] = int(os.environ.get("ACTIVITY_LOG_QUEUE_SIZE", "10000"))
+    config['ACTIVITY_LOG_SYNC'] = os.environ.get("ACTIVITY_LOG_SYNC", "false").lower() == "true"
+    
+    # Decoded tokens and user rows are cached per process for AUTH_CACHE_TTL seconds (0 disables)
+    config['AUTH_CACHE_TTL'] = float(os.environ.get("AUTH_CACHE_TTL", "60"))
+    config['AUTH_CACHE_SIZE'] = int(os.environ.get("AUTH_CACHE_SIZE", "4096"))
+    
+    # Raw activity rows older than ACTIVITY_RETENTION_DAYS are moved to gzip NDJSON files
+    # (one per UTC day) by `flask activity-maintenance`; daily rollups are kept in the database
+    config['ACTIVITY_RETENTION_DAYS'] = int(os.environ.get("ACTIVITY_RETENTION_DAYS", "90"))
+    config['ACTIVITY_ARCHIVE_FOLDER'] = os.environ.get(
+        "ACTIVITY_ARCHIVE_FOLDER", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'activity-archive'))
+    
+    # Trending scores. `flask update-trending` (run it from cron every few minutes) sets
+    # Course.popularity_score from course views in the last TRENDING_WINDOW_DAYS and from
+    # enrollment gains, each decayed with a TRENDING_HALF_LIFE_HOURS half-life. Every
+    # worker keeps the TRENDING_TOP_K best in memory, reloaded every TRENDING_REFRESH_INTERVAL seconds.
+    config['TRENDING_HALF_LIFE_HOURS'] = float(os.environ.get("TRENDING_HALF_LIFE_HOURS", "72"))
+    config['TRENDING_WINDOW_DAYS'] = int(os.environ.get("TRENDING_WINDOW_DAYS", "30"))
+    config['TRENDING_ENROLLMENT_WEIGHT'] = float(os.environ.get("TRENDING_ENROLLMENT_WEIGHT", "10"))
+    config['TRENDING_TOP_K'] = int(os.environ.get("TRENDING_TOP_K", "100"))
+    config['TRENDING_REFRESH_INTERVAL'] = float(os.environ.get("TRENDING_REFRESH_INTERVAL", "60"))
+    
+    # Related courses. `flask update-related-courses` (run it nightly) counts the users who
+    # viewed each pair of courses in the last RELATED_WINDOW_DAYS and keeps the RELATED_TOP_N
+    # closest per course; courses with fewer co-viewed neighbours are filled from their category.
+    # Users who viewed more than RELATED_MAX_VIEWS_PER_USER courses count only their latest ones.
+    config['RELATED_WINDOW_DAYS'] = int(os.environ.get("RELATED_WINDOW_DAYS", "90"))
+    config['RELATED_TOP_N'] = int(os.environ.get("RELATED_TOP_N", "10"))
+    config['RELATED_MAX_VIEWS_PER_USER'] = int(os.environ.get("RELATED_MAX_VIEWS_PER_USER", "200"))
+    
+    # Password hashing runs in a pool of PASSWORD_HASH_WORKERS processes (0 hashes inline).
+    # PASSWORD_HASH_METHOD is any werkzeug method spec, e.g. 'pbkdf2:sha256:600000' or 'scrypt:32768:8:1';
+    # stored hashes made with other parameters are upgraded on the next successful login.
+    config['PASSWORD_HASH_METHOD'] = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+    config['PASSWORD_HASH_WORKERS'] = int(os.environ.get("PASSWORD_HASH_WORKERS", "2"))
+    config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", "64"))
+    
+    # Request metrics (latency, SQL statements and DB time, response size per endpoint) are
+    # exposed in Prometheus text format on /api/metrics, behind METRICS_TOKEN if it is set.
+    # Requests slower than SLOW_REQUEST_MS are logged with their SQL (0 disables).
+    config['METRICS_ENABLED'] = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+    config['METRICS_TOKEN'] = os.environ.get("METRICS_TOKEN", "")
+    config['SLOW_REQUEST_MS'] = float(os.environ.get("SLOW_REQUEST_MS", "0"))
+    
+    # Response compression (gzip, or brotli when installed) for bodies of at least
+    # COMPRESSION_MIN_SIZE bytes. Compressed bodies of responses with an ETag are
+    # cached (at most COMPRESSION_CACHE_SIZE), so a cached catalog page is compressed once.
+    config['COMPRESSION_ENABLED'] = os.environ.get("COMPRESSION_ENABLED", "true").lower() == "true"
+    config['COMPRESSION_MIN_SIZE'] = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+    config['COMPRESSION_GZIP_LEVEL'] = int(os.environ.get("COMPRESSION_GZIP_LEVEL", "6"))
+    config['COMPRESSION_BROTLI_QUALITY'] = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", "5"))
+    config['COMPRESSION_CACHE_SIZE'] = int(os.environ.get("COMPRESSION_CACHE_SIZE", "256"))
+    
+    # Catalog responses are cached per process until the catalog changes, or at most CATALOG_CACHE_TTL seconds
+    config['CATALOG_CACHE_TTL'] = float(os.environ.get("CATALOG_CACHE_TTL", "30"))
+    config['CATALOG_CACHE_SIZE'] = int(os.environ.get("CATALOG_CACHE_SIZE", "512"))
+    
+    # Uploaded media serving. Files with the generated "_<timestamp>_<uuid8>" suffix
+    # never change, so browsers may cache them indefinitely. MEDIA_OFFLOAD hands
+    # the transfer to a front proxy: 'x-accel-redirect' (nginx, internal location
+    # MEDIA_ACCEL_PREFIX mapped to UPLOAD_FOLDER) or 'x-sendfile' (Apache/lighttpd).
+    config['MEDIA_OFFLOAD'] = os.environ.get("MEDIA_OFFLOAD", "").lower()
+    config['MEDIA_ACCEL_PREFIX'] = os.environ.get("MEDIA_ACCEL_PREFIX", "/protected-uploads").rstrip('/')
+    config['MEDIA_MAX_AGE'] = int(os.environ.get("MEDIA_MAX_AGE", "3600"))  # for files without a unique suffix
+    
+    # Unreferenced blobs younger than this are kept by `flask gc-blobs`
+    config['BLOB_GC_GRACE_SECONDS'] = int(os.environ.get("BLOB_GC_GRACE_SECONDS", "3600"))
+    
+    # Media worker job retries (flask media-worker)
+    config['MEDIA_JOB_MAX_ATTEMPTS'] = int(os.environ.get("MEDIA_JOB_MAX_ATTEMPTS", "3"))
+    config['MEDIA_JOB_STALE_SECONDS'] = int(os.environ.get("MEDIA_JOB_STALE_SECONDS", "900"))
+    # Images with more pixels than this are not decoded (decompression bomb guard)
+    config['MEDIA_MAX_IMAGE_PIXELS'] = int(os.environ.get("MEDIA_MAX_IMAGE_PIXELS", str(50 * 1000 * 1000)))
+    
+    # Chunked upload sessions are staged outside UPLOAD_FOLDER so partial files are never served
+    config['UPLOAD_SESSIONS_FOLDER'] = os.environ.get("UPLOAD_SESSIONS_FOLDER", UPLOAD_SESSIONS_FOLDER)
+    config['UPLOAD_CHUNK_SIZE'] = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))  # 8MB default chunk
+    config['UPLOAD_MAX_CHUNK_SIZE'] = 64 * 1024 * 1024
+    config['UPLOAD_SESSION_MAX_SIZE'] = int(os.environ.get("UPLOAD_SESSION_MAX_SIZE", str(5 * 1024 * 1024 * 1024)))  # 5GB
+    # Each user may have UPLOAD_MAX_OPEN_SESSIONS open sessions; `flask expire-upload-sessions`
+    # removes open sessions that received no chunk for UPLOAD_SESSION_EXPIRY_HOURS
+    config['UPLOAD_MAX_OPEN_SESSIONS'] = int(os.environ.get("UPLOAD_MAX_OPEN_SESSIONS", "5"))
+    config['UPLOAD_SESSION_EXPIRY_HOURS'] = float(os.environ.get("UPLOAD_SESSION_EXPIRY_HOURS", "24"))
+
+# Read replica routing. Replicas are extra binds named replica_<n>. Inside a
+# request to a @read_replica endpoint, the session sends plain reads to a
+# healthy replica and everything else to the primary. Once the session has
+# written, its later reads go to the primary too (read-your-writes), and
+# finish_read_replica_request() pins the authenticated user to the primary for
+# a while. Pins are kept in a table on the primary, since API clients don't send
+# cookies back and the user's next request may reach another worker process.
+# In the SQLite profile, writes (and reads in the same transaction after a
+# write, so it sees its own changes) go to the SQLITE_WRITER_BIND engine.
+SQLITE_WRITER_BIND = 'sqlite_writer'
+
+class RoutingSession(FlaskSQLAlchemySession):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and (current_app.config['DATABASE_REPLICA_URLS'] or SQLITE_WRITER_BIND in db.engines):
+            # Flushes ask for a bind by mapper alone, without a statement
+            if self._flushing or (clause is not None and not is_read_statement(clause)):
+                self.info['wrote'] = True  # for the rest of the request
+                self.info['writing'] = True  # until the transaction ends
+            elif is_read_statement(clause) and current_app.config['DATABASE_REPLICA_URLS']:
+                replica = replica_router.bind_for(self)
+                if replica is not None:
+                    return replica
+            if self.info.get('writing') and SQLITE_WRITER_BIND in db.engines:
+                return db.engines[SQLITE_WRITER_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def release_writer(routing_session, transaction):
+    # Committed data is visible to every connection, so later reads needn't hold the writer
+    if transaction.parent is None:
+        routing_session.info.pop('writing', None)
+
+def is_read_statement(clause):
+    if isinstance(clause, Select):
+        return True
+    return isinstance(clause, TextClause) and clause.text.lstrip()[:6].upper() == 'SELECT'
+
+class ReplicaRouter:
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.lock = threading.Lock()
+        self.down_until = {}
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.fallbacks = 0
+        self.pins = {}  # user id -> primary_until for pins made by this process
+    
+    def bind_keys(self):
+        return [f'replica_{i}' for i in range(len(self.app.config['DATABASE_REPLICA_URLS']))]
+    
+    def bind_for(self, routing_session):
+        if not has_request_context() or not g.get('read_replica'):
+            return None
+        if routing_session.info.get('wrote'):
+            with self.lock:
+                self.primary_reads += 1
+            return None
+        
+        # Keep one replica per session so a request sees a single consistent snapshot
+        key = routing_session.info.get('replica')
+        if key is None:
+            key = self.choose(routing_session)
+        if key is None:
+            return None
+        with self.lock:
+            self.replica_reads += 1
+        return db.engines[key]
+    
+    def choose(self, routing_session):
+        now = time.monotonic()
+        with self.lock:
+            candidates = [key for key in self.bind_keys() if self.down_until.get(key, 0) <= now]
+        random.shuffle(candidates)
+        for key in candidates:
+            try:
+                # Checks a pooled connection out and straight back in; pre-ping catches dead ones
+                with db.engines[key].connect():
+                    pass
+            except OperationalError as e:
+                self.mark_down(key, e)
+                continue
+            routing_session.info['replica'] = key
+            return key
+        
+        with self.lock:
+            self.fallbacks += 1
+        # Don't probe again for the rest of this request
+        g.read_replica = False
+        return None
+    
+    def mark_down(self, key, error):
+        logger.warning(f"Read replica {key} unavailable, retrying in "
+                       f"{self.app.config['READ_REPLICA_RETRY_SECONDS']}s: {str(error)}")
+        with self.lock:
+            self.down_until[key] = time.monotonic() + self.app.config['READ_REPLICA_RETRY_SECONDS']
+    
+    def fail_over(self, routing_session, key, error):
+        """Send the rest of this request's reads to the primary after replica key failed a query."""
+        self.mark_down(key, error)
+        routing_session.info.pop('replica', None)
+        g.read_replica = False
+        with self.lock:
+            self.fallbacks += 1
+    
+    def request_user_id(self):
+        auth_header = request.headers.get('Authorization', '')
+        if not auth_header.startswith('Bearer '):
+            return None
+        try:
+            return auth_cache.decode_token(auth_header[7:])['user_id']
+        except Exception:
+            return None
+    
+    def pinned_to_primary(self):
+        """Whether this request's user wrote in the last READ_REPLICA_STICKY_SECONDS (checked once per request)."""
+        if 'primary_pinned' not in g:
+            g.primary_pinned = self.is_pinned(self.request_user_id())
+        return g.primary_pinned
+    
+    def is_pinned(self, user_id):
+        if user_id is None:
+            return False
+        now = datetime.utcnow()
+        with self.lock:
+            if self.pins.get(user_id, now) > now:
+                return True
+        # The pin may come from another worker process. Asked before g.read_replica is set, so this reads the primary
+        primary_until = db.session.execute(
+            db.select(ReplicaPin.primary_until).where(ReplicaPin.user_id == user_id)).scalar()
+        return primary_until is not None and primary_until > now
+    
+    def pin(self, user_id):
+        now = datetime.utcnow()
+        primary_until = now + timedelta(seconds=self.app.config['READ_REPLICA_STICKY_SECONDS'])
+        with self.lock:
+            self.pins[user_id] = primary_until
+            if len(self.pins) > 10000:
+                self.pins = {key: until for key, until in self.pins.items() if until > now}
+        
+        dialect = db.engine.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            insert = sqlite_insert if dialect == 'sqlite' else postgresql_insert
+            stmt = insert(ReplicaPin).values(user_id=user_id, primary_until=primary_until)
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=[ReplicaPin.user_id], set_={'primary_until': stmt.excluded.primary_until}))
+        else:
+            result = db.session.execute(db.update(ReplicaPin).where(ReplicaPin.user_id == user_id)
+                                        .values(primary_until=primary_until))
+            if result.rowcount == 0:
+                db.session.add(ReplicaPin(user_id=user_id, primary_until=primary_until))
+        db.session.commit()
+    
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                'replicas': self.bind_keys(),
+                'unavailable': sorted(key for key, until in self.down_until.items() if until > now),
+                'replica_reads': self.replica_reads,
+                'primary_reads': self.primary_reads,
+                'fallbacks': self.fallbacks,
+                'sticky_seconds': self.app.config['READ_REPLICA_STICKY_SECONDS']
+            }
 
-# Create upload directories if they don't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(COURSE_RESOURCES_FOLDER, exist_ok=True)
+def read_replica(f):
+    """Let the endpoint's reads go to a read replica, unless this user wrote recently."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if current_app.config['DATABASE_REPLICA_URLS'] and not replica_router.pinned_to_primary():
+            g.read_replica = True
+        try:
+            return f(*args, **kwargs)
+        except OperationalError as e:
+            # A replica can accept connections and still fail queries (e.g. no schema yet).
+            # Take it out of rotation and run the endpoint once more on the primary.
+            key = db.session.info.get('replica') if db.session.registry.has() else None
+            if key is None or db.session.info.get('wrote'):
+                raise
+            db.session.rollback()
+            replica_router.fail_over(db.session, key, e)
+            return f(*args, **kwargs)
+    
+    return decorated
+
+# Initialize SQLAlchemy (bound to the app by create_app)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
+replica_router = app_service('replica_router')
 
-# Initialize SQLAlchemy with app
-db = SQLAlchemy(model_class=Base)
-db.init_app(app)
+# Define replica pin model: users whose reads go to the primary until
+# primary_until (UTC) because they wrote recently
+class ReplicaPin(db.Model):
+    user_id = db.Column(db.Integer, primary_key=True)
+    primary_until = db.Column(db.DateTime, nullable=False)
+
+@api.after_app_request
+def finish_read_replica_request(response):
+    # Pin the user to the primary until replicas have caught up with this request's writes
+    if current_app.config['DATABASE_REPLICA_URLS'] and db.session.registry.has() and db.session.info.get('wrote'):
+        user_id = replica_router.request_user_id()
+        if user_id is not None:
+            try:
+                replica_router.pin(user_id)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error pinning user {user_id} to the primary: {str(e)}")
+    return response
 
 # Define User model
 class User(db.Model):
@@ -57,11 +489,17 @@ class User(db.Model):
     username = db.Column(db.String(100))
     role = db.Column(db.String(20), default='user')  # 'user', 'teacher', or 'admin'
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    last_login = db.Column(db.DateTime)
+    last_login = db.Column(db.DateTime, index=True)
     user_metadata = db.Column(db.JSON, default={})  # Renamed from 'metadata' to 'user_metadata'
     
-    def to_dict(self):
-        return {
+    __table_args__ = (
+        db.Index('ix_user_created_at_id', 'created_at', 'id'),  # keyset pagination by created_at
+    )
+    
+    API_FIELDS = ('id', 'email', 'username', 'role', 'created_at', 'last_login', 'metadata')
+    
+    def to_dict(self, fields=None):
+        data = {
             'id': self.id,
             'email': self.email,
             'username': self.username,
@@ -70,6 +508,9 @@ class User(db.Model):
             'last_login': self.last_login.isoformat() if self.last_login else None,
             'metadata': self.user_metadata  # Keep the field name in the API response the same for compatibility
         }
+        if fields is not None:
+            data = {key: value for key, value in data.items() if key in fields}
+        return data
 
 # Define Course model
 class Course(db.Model):
@@ -82,18 +523,31 @@ class Course(db.Model):
     rating = db.Column(db.Float, default=0.0)
     duration = db.Column(db.String(50))
     price = db.Column(db.String(50))
-    category = db.Column(db.String(100))
+    category = db.Column(db.String(100), index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     view_count = db.Column(db.Integer, default=0)
     enrollment_count = db.Column(db.Integer, default=0)
     popularity_score = db.Column(db.Integer, default=0)
+    resources = db.relationship('CourseResource', backref='course', lazy='select',
+                                order_by='CourseResource.id', cascade='all, delete-orphan')
     
-    def to_dict(self):
-        resources = CourseResource.query.filter_by(course_id=self.id).all()
-        return {
+    # Sort key + id pairs serve both ORDER BY and the keyset range predicate
+    __table_args__ = (
+        db.Index('ix_course_view_count_id', 'view_count', 'id'),
+        db.Index('ix_course_popularity_score_id', 'popularity_score', 'id'),
+        db.Index('ix_course_created_at_id', 'created_at', 'id'),
+    )
+    
+    API_FIELDS = ('id', 'title', 'description', 'author', 'image', 'rating', 'duration', 'price',
+                  'category', 'createdAt', 'viewCount', 'enrollmentCount', 'popularityScore', 'resources')
+    
+    def to_dict(self, fields=None):
+        if fields is None:
+            fields = self.API_FIELDS
+        data = {
             'id': str(self.id),
             'title': self.title,
-            'description': self.description,
+            'description': self.description if 'description' in fields else None,
             'author': self.author,
             'image': self.image,
             'rating': self.rating,
@@ -103,20 +557,33 @@ class Course(db.Model):
             'createdAt': self.created_at.isoformat(),
             'viewCount': self.view_count,
             'enrollmentCount': self.enrollment_count,
-            'popularityScore': self.popularity_score,
-            'resources': [resource.to_dict() for resource in resources] if resources else []
+            'popularityScore': self.popularity_score
         }
+        # Only touch the relationship when asked for, so projected listings never load resources
+        if 'resources' in fields:
+            data['resources'] = [resource.to_dict() for resource in self.resources]
+        if fields is not self.API_FIELDS:
+            data = {key: value for key, value in data.items() if key in fields}
+        return data
 
 # Define Course Resource model for storing uploaded files info
 class CourseResource(db.Model):
     # ... keep existing code (CourseResource model definition)
     id = db.Column(db.Integer, primary_key=True)
-    course_id = db.Column(db.Integer, db.ForeignKey('course.id'))
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), index=True)
     name = db.Column(db.String(255), nullable=False)
     type = db.Column(db.String(50), nullable=False)  # 'video', 'pdf', 'image', 'other'
     url = db.Column(db.String(255), nullable=False)
-    size = db.Column(db.Integer)  # file size in bytes
+    size = db.Column(db.BigInteger)  # file size in bytes
+    blob_hash = db.Column(db.String(64), index=True)  # SHA-256 of the stored blob for uploaded files
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Filled in by the media worker
+    processing_status = db.Column(db.String(20))  # None (not processed), 'pending', 'done', 'failed'
+    checksum = db.Column(db.String(64))
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    page_count = db.Column(db.Integer)
+    derivatives = db.Column(db.JSON)  # e.g. {'thumbnail': url, 'webp_640': url, 'poster': url}
     
     def to_dict(self):
         return {
@@ -125,17 +592,24 @@ class CourseResource(db.Model):
             'type': self.type,
             'url': self.url,
             'size': self.size,
-            'uploadedAt': self.created_at.isoformat()
+            'uploadedAt': self.created_at.isoformat(),
+            'processingStatus': self.processing_status,
+            'checksum': self.checksum,
+            'width': self.width,
+            'height': self.height,
+            'pageCount': self.page_count,
+            'derivatives': self.derivatives or {}
         }
 
 # Define activity log model for tracking user activities
 class ActivityLog(db.Model):
     # ... keep existing code (ActivityLog model definition)
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     action_type = db.Column(db.String(50), nullable=False)  # e.g., 'login', 'course_view', 'enrollment'
     details = db.Column(db.String(255))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    course_id = db.Column(db.Integer, index=True)  # course the event is about, if any (no FK: logs outlive courses)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     def to_dict(self):
         return {
@@ -143,9 +617,1243 @@ class ActivityLog(db.Model):
             'user_id': self.user_id,
             'action_type': self.action_type,
             'details': self.details,
+            'course_id': self.course_id,
             'created_at': self.created_at.isoformat()
         }
 
+# Define activity rollup model: per-day (UTC) event counts by action type
+# and course. Rollups outlive the raw ActivityLog rows, which are archived
+# after ACTIVITY_RETENTION_DAYS.
+class ActivityRollup(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    action_type = db.Column(db.String(50), primary_key=True)
+    course_id = db.Column(db.Integer, primary_key=True, default=0)  # 0 for events not about a course
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat(),
+            'action_type': self.action_type,
+            'course_id': self.course_id or None,
+            'count': self.count
+        }
+
+# Define course trend model: the trending job's state per course. score is
+# the unrounded popularity_score; enrollment_score is the decayed sum of
+# enrollment gains seen between runs.
+class CourseTrend(db.Model):
+    course_id = db.Column(db.Integer, primary_key=True)  # no FK, rows for deleted courses are dropped by the job
+    score = db.Column(db.Float, nullable=False, default=0.0, index=True)
+    enrollment_score = db.Column(db.Float, nullable=False, default=0.0)
+    last_enrollment_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# Define related course model: each course's precomputed neighbours in rank
+# order, so the related endpoint is one primary key range lookup. source is
+# 'coview' for co-viewed courses and 'category' for cold-start fill.
+class RelatedCourse(db.Model):
+    course_id = db.Column(db.Integer, primary_key=True)  # no FK, the job drops rows for deleted courses
+    rank = db.Column(db.SmallInteger, primary_key=True)
+    related_id = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Float, nullable=False, default=0.0)
+    source = db.Column(db.String(10), nullable=False)
+
+# Define media job model: the database-backed queue the media worker
+# drains to generate derivatives and metadata for uploaded resources
+class MediaJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    resource_id = db.Column(db.Integer, db.ForeignKey('course_resource.id', ondelete='CASCADE'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)  # 'pending', 'running', 'done', 'failed'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+# Define upload session model for resumable chunked uploads. Chunks are
+# stored as numbered files in the session's staging directory, so
+# receiving a chunk never writes to the database.
+class UploadSession(db.Model):
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    file_type = db.Column(db.String(50), nullable=False, default='other')
+    folder = db.Column(db.String(255), nullable=False, default='general')
+    course_id = db.Column(db.String(20))
+    course_title = db.Column(db.String(255))
+    total_size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    checksum = db.Column(db.String(64))  # expected SHA-256 of the whole file, if the client sent one
+    status = db.Column(db.String(20), nullable=False, default='open')  # 'open', 'finalizing', 'complete'
+    file_url = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+    
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+    
+    @property
+    def staging_path(self):
+        return os.path.join(current_app.config['UPLOAD_SESSIONS_FOLDER'], self.id)
+    
+    def chunk_length(self, index):
+        if index == self.total_chunks - 1:
+            return self.total_size - index * self.chunk_size
+        return self.chunk_size
+    
+    def received_chunks(self):
+        if not os.path.isdir(self.staging_path):
+            return []
+        return sorted(int(name[:-len('.part')]) for name in os.listdir(self.staging_path)
+                      if name.endswith('.part') and name[:-len('.part')].isdigit())
+    
+    def to_dict(self):
+        received = self.received_chunks() if self.status == 'open' else list(range(self.total_chunks))
+        received_set = set(received)
+        
+        # Merge received chunks into contiguous byte ranges (inclusive, like HTTP Range)
+        ranges = []
+        for index in received:
+            start = index * self.chunk_size
+            end = start + self.chunk_length(index) - 1
+            if ranges and ranges[-1][1] == start - 1:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        
+        return {
+            'sessionId': self.id,
+            'fileName': self.filename,
+            'type': self.file_type,
+            'totalSize': self.total_size,
+            'chunkSize': self.chunk_size,
+            'totalChunks': self.total_chunks,
+            'status': self.status,
+            'receivedChunks': received,
+            'receivedRanges': ranges,
+            'missingChunks': [index for index in range(self.total_chunks) if index not in received_set],
+            'fileUrl': self.file_url,
+            'createdAt': self.created_at.isoformat()
+        }
+
+# Define dashboard statistics model. The admin dashboard reads these
+# counters instead of aggregating the user and course tables; they are
+# updated in the same transaction as the writes that change them.
+# Keys: total_users, total_courses, total_enrollments,
+# category:<name>, new_users:<YYYY-MM-DD>, logins:<YYYY-MM-DD> (UTC days)
+class DashboardStat(db.Model):
+    key = db.Column(db.String(150), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+def bump_stats(deltas):
+    """Atomically add each delta to its counter, creating missing counters."""
+    dialect = db.engine.dialect.name
+    for key, delta in deltas.items():
+        if not delta:
+            continue
+        if dialect in ('sqlite', 'postgresql'):
+            insert = sqlite_insert if dialect == 'sqlite' else postgresql_insert
+            stmt = insert(DashboardStat).values(key=key, value=delta)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[DashboardStat.key],
+                set_={'value': DashboardStat.value + stmt.excluded.value}
+            )
+            db.session.execute(stmt)
+        else:
+            result = db.session.execute(
+                db.update(DashboardStat).where(DashboardStat.key == key).values(value=DashboardStat.value + delta)
+            )
+            if result.rowcount == 0:
+                db.session.add(DashboardStat(key=key, value=delta))
+
+def course_stat_deltas(course, sign=1):
+    return {
+        'total_courses': sign,
+        f"category:{course.category or ''}": sign,
+        'total_enrollments': sign * (course.enrollment_count or 0),
+    }
+
+def rebuild_dashboard_stats():
+    """Recompute every counter from the base tables."""
+    db.session.execute(db.delete(DashboardStat))
+    stats = {
+        'total_users': User.query.count(),
+        'total_courses': Course.query.count(),
+        'total_enrollments': db.session.query(db.func.sum(Course.enrollment_count)).scalar() or 0,
+    }
+    for category, count in db.session.query(Course.category, db.func.count(Course.id)).group_by(Course.category):
+        key = f"category:{category or ''}"
+        stats[key] = stats.get(key, 0) + count
+    for day, count in db.session.query(db.func.date(User.created_at), db.func.count(User.id)).group_by(db.func.date(User.created_at)):
+        stats[f"new_users:{day}"] = count
+    for day, count in (db.session.query(db.func.date(User.last_login), db.func.count(User.id))
+                       .filter(User.last_login.isnot(None)).group_by(db.func.date(User.last_login))):
+        stats[f"logins:{day}"] = count
+    db.session.add_all([DashboardStat(key=key, value=value) for key, value in stats.items()])
+
+@api.cli.command('rebuild-dashboard-stats')
+def rebuild_dashboard_stats_command():
+    """Recompute the admin dashboard counters from the user and course tables."""
+    rebuild_dashboard_stats()
+    db.session.commit()
+    print(f"Rebuilt {DashboardStat.query.count()} dashboard counters")
+
+# Columns added to existing tables after their first release. db.create_all()
+# only creates missing tables, so upgrade_schema() adds these (and any
+# missing indexes) to databases created by older versions.
+ADDED_COLUMNS = [
+    CourseResource.__table__.c.blob_hash,
+    CourseResource.__table__.c.processing_status,
+    CourseResource.__table__.c.checksum,
+    CourseResource.__table__.c.width,
+    CourseResource.__table__.c.height,
+    CourseResource.__table__.c.page_count,
+    CourseResource.__table__.c.derivatives,
+    ActivityLog.__table__.c.course_id,
+]
+
+# Integer columns later widened to BIGINT. SQLite integers are 64-bit already,
+# so only Postgres needs them altered.
+WIDENED_COLUMNS = [
+    CourseResource.__table__.c.size,
+]
+
+def upgrade_schema():
+    inspector = db.inspect(db.engine)
+    for column in ADDED_COLUMNS:
+        existing = {info['name'] for info in inspector.get_columns(column.table.name)}
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(text(f"ALTER TABLE {column.table.name} ADD COLUMN {column.name} {column_type}"))
+            logger.info(f"Added column {column.table.name}.{column.name}")
+    
+    if db.engine.dialect.name == 'postgresql':
+        for column in WIDENED_COLUMNS:
+            types = {info['name']: info['type'] for info in inspector.get_columns(column.table.name)}
+            if isinstance(types.get(column.name), db.Integer) and not isinstance(types[column.name], db.BigInteger):
+                db.session.execute(text(f"ALTER TABLE {column.table.name} ALTER COLUMN {column.name} TYPE BIGINT"))
+                logger.info(f"Widened column {column.table.name}.{column.name} to BIGINT")
+    
+    # Keyset pagination compares sort keys directly, so they must not be NULL
+    for column in (Course.view_count, Course.popularity_score, Course.enrollment_count):
+        db.session.execute(db.update(Course).where(column.is_(None)).values({column: 0}))
+    db.session.commit()
+    
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+# Course listings load resources for the whole page in one extra query
+# instead of one query per course when to_dict() is called
+def course_list_query():
+    return Course.query.options(selectinload(Course.resources))
+
+# Keyset (cursor) pagination for list endpoints. Pages are ordered by a
+# stable sort key with the primary key as tie-breaker, and the cursor
+# carries the last row's (sort value, id) so the next page is a range scan
+# instead of an OFFSET.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+COURSE_SORT_KEYS = {
+    'id': Course.id,
+    'created_at': Course.created_at,
+    'view_count': Course.view_count,
+    'popularity_score': Course.popularity_score,
+}
+
+USER_SORT_KEYS = {
+    'id': User.id,
+    'created_at': User.created_at,
+}
+
+def is_paginated_request():
+    # Plain list requests keep returning a bare array for existing clients
+    return any(arg in request.args for arg in ('limit', 'cursor', 'fields', 'sort'))
+
+def parse_fields(allowed_fields):
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in requested if field not in allowed_fields]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return set(requested)
+
+def encode_cursor(value, row_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([value, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+def decode_cursor(cursor, sort_column=None):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if value is not None and sort_column is not None and isinstance(sort_column.type, db.DateTime):
+            value = datetime.fromisoformat(value)
+        return value, int(row_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError('Invalid cursor')
+
+# Search results are ranked by relevance, which has no stable key to seek
+# from, so search pages with an offset carried in a cursor marked 'offset'
+def encode_offset_cursor(offset):
+    return encode_cursor('offset', offset)
+
+def decode_offset_cursor(cursor):
+    marker, offset = decode_cursor(cursor)
+    # Keyset cursors from the list endpoints don't carry an offset
+    if marker != 'offset' or offset < 0:
+        raise ValueError('Invalid cursor')
+    return offset
+
+def paginate_keyset(query, id_column, sort_keys, default_sort='id'):
+    """Apply ?sort=, ?order=, ?limit= and ?cursor= to query.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    Raises ValueError for malformed arguments.
+    """
+    sort = request.args.get('sort', default_sort)
+    if sort not in sort_keys:
+        raise ValueError(f"Invalid sort key. Use one of: {', '.join(sort_keys)}")
+    sort_column = sort_keys[sort]
+    descending = request.args.get('order', 'desc' if sort != 'id' else 'asc') == 'desc'
+    
+    limit = parse_page_limit()
+    
+    # Compare the bare column so the (sort key, id) index serves the range scan;
+    # upgrade_schema() backfills NULL sort keys so no row falls outside the predicate
+    sort_expr = sort_column
+    
+    cursor = request.args.get('cursor')
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort_column)
+        if value == 'offset':
+            raise ValueError('Invalid cursor')
+        if sort_column is id_column:
+            query = query.filter(id_column < last_id if descending else id_column > last_id)
+        elif descending:
+            query = query.filter(db.or_(sort_expr < value, db.and_(sort_expr == value, id_column < last_id)))
+        else:
+            query = query.filter(db.or_(sort_expr > value, db.and_(sort_expr == value, id_column > last_id)))
+    
+    if sort_column is id_column:
+        query = query.order_by(id_column.desc() if descending else id_column.asc())
+    elif descending:
+        query = query.order_by(sort_expr.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_expr.asc(), id_column.asc())
+    
+    # Fetch one extra row to learn whether another page exists
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        last_value = getattr(last, sort_column.key)
+        next_cursor = encode_cursor(last_value, getattr(last, id_column.key))
+    return rows, next_cursor
+
+def parse_page_limit():
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def paginated_response(items, next_cursor):
+    return {
+        'items': items,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    }
+
+# Full-text course search. SQLite databases get an FTS5 table that the
+# course write endpoints keep in sync; Postgres gets a GIN expression index
+# over a weighted tsvector, which the database maintains on its own. If
+# neither is available search falls back to ILIKE matching.
+COURSE_SEARCH_FIELDS = ('title', 'description', 'category', 'author')
+
+# Column weights for bm25(): title matches outrank category/author, which outrank description
+COURSE_SEARCH_BM25_WEIGHTS = '10.0, 1.0, 4.0, 4.0'
+
+COURSE_TSVECTOR_SQL = (
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(category, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(author, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'C')"
+)
+
+def detect_search_backend():
+    # Read-only check; init_search_index() creates the index
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        current_app.config['SEARCH_BACKEND'] = 'postgres'
+    elif dialect == 'sqlite' and db.session.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'course_search'"
+    )).first():
+        current_app.config['SEARCH_BACKEND'] = 'fts5'
+    else:
+        current_app.config['SEARCH_BACKEND'] = 'like'
+
+def search_backend():
+    """The search backend in use. Until an index exists this is re-checked on every call,
+    since `flask init-db` may create the FTS5 index after the workers have started."""
+    if current_app.config.get('SEARCH_BACKEND') in (None, 'like'):
+        detect_search_backend()
+    return current_app.config['SEARCH_BACKEND']
+
+def init_search_index():
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        db.session.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_course_search ON course USING GIN (({COURSE_TSVECTOR_SQL}))"
+        ))
+        db.session.commit()
+        current_app.config['SEARCH_BACKEND'] = 'postgres'
+        return
+    
+    if dialect == 'sqlite':
+        try:
+            exists = db.session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'course_search'"
+            )).first()
+            if not exists:
+                db.session.execute(text(
+                    "CREATE VIRTUAL TABLE course_search USING fts5("
+                    "title, description, category, author, tokenize = 'unicode61 remove_diacritics 2')"
+                ))
+                # Backfill courses created before the index existed
+                rebuild_search_index()
+                db.session.commit()
+            current_app.config['SEARCH_BACKEND'] = 'fts5'
+            return
+        except OperationalError as e:
+            db.session.rollback()
+            logger.warning(f"FTS5 unavailable, falling back to LIKE search: {str(e)}")
+    
+    current_app.config['SEARCH_BACKEND'] = 'like'
+
+def rebuild_search_index():
+    db.session.execute(text("DELETE FROM course_search"))
+    db.session.execute(text(
+        "INSERT INTO course_search (rowid, title, description, category, author) "
+        "SELECT id, title, coalesce(description, ''), coalesce(category, ''), author FROM course"
+    ))
+
+@api.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Re-populate the FTS5 course index from the course table."""
+    if search_backend() != 'fts5':
+        print(f"Nothing to rebuild for search backend '{search_backend()}'")
+        return
+    rebuild_search_index()
+    db.session.commit()
+    print(f"Indexed {Course.query.count()} courses")
+
+def index_course(course):
+    # Must run inside the transaction that writes the course (after a flush, so the id exists)
+    if search_backend() != 'fts5':
+        return
+    unindex_course(course.id)
+    db.session.execute(
+        text("INSERT INTO course_search (rowid, title, description, category, author) "
+             "VALUES (:id, :title, :description, :category, :author)"),
+        {
+            'id': course.id,
+            'title': course.title,
+            'description': course.description or '',
+            'category': course.category or '',
+            'author': course.author,
+        }
+    )
+
+def unindex_course(course_id):
+    if search_backend() != 'fts5':
+        return
+    db.session.execute(text("DELETE FROM course_search WHERE rowid = :id"), {'id': course_id})
+
+def search_course_ids(terms, limit=None, offset=0):
+    """Return ids of courses matching every term (as a prefix), best match first."""
+    backend = search_backend()
+    paging = ' LIMIT :limit OFFSET :offset' if limit is not None else ''
+    params = {'limit': limit, 'offset': offset}
+    
+    if backend == 'fts5':
+        params['match'] = ' '.join(f'"{term}"*' for term in terms)
+        rows = db.session.execute(text(
+            f"SELECT rowid FROM course_search WHERE course_search MATCH :match "
+            f"ORDER BY bm25(course_search, {COURSE_SEARCH_BM25_WEIGHTS}), rowid{paging}"
+        ), params)
+    elif backend == 'postgres':
+        params['tsquery'] = ' & '.join(f'{term}:*' for term in terms)
+        rows = db.session.execute(text(
+            f"SELECT id FROM course, to_tsquery('simple', :tsquery) AS query "
+            f"WHERE ({COURSE_TSVECTOR_SQL}) @@ query "
+            f"ORDER BY ts_rank_cd({COURSE_TSVECTOR_SQL}, query) DESC, id{paging}"
+        ), params)
+    else:
+        query = db.session.query(Course.id)
+        for term in terms:
+            query = query.filter(db.or_(*[getattr(Course, field).ilike(f'%{term}%') for field in COURSE_SEARCH_FIELDS]))
+        query = query.order_by(Course.id)
+        if limit is not None:
+            query = query.limit(limit).offset(offset)
+        rows = query
+    
+    return [row[0] for row in rows]
+
+# Write-behind view counter. Course views are coalesced in memory per
+# course and written periodically as atomic increments, so reading a
+# course never takes the database write lock.
+class ViewCounterBuffer:
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.flushed_total = 0
+        self.flush_count = 0
+        self.last_flush_at = None
+        self.thread = None
+        self.thread_pid = None
+        self.stop_event = threading.Event()
+    
+    def increment(self, course_id, amount=1):
+        with self.lock:
+            self.pending[course_id] = self.pending.get(course_id, 0) + amount
+        if self.app.config['VIEW_COUNT_FLUSH_INTERVAL'] <= 0:
+            self.flush()
+        else:
+            self.ensure_started()
+    
+    def pending_for(self, course_id):
+        with self.lock:
+            return self.pending.get(course_id, 0)
+    
+    def ensure_started(self):
+        # Threads don't survive fork, so each worker process starts its own flusher
+        if self.thread is not None and self.thread_pid == os.getpid() and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is not None and self.thread_pid == os.getpid() and self.thread.is_alive():
+                return
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, name='view-counter-flush', daemon=True)
+            self.thread_pid = os.getpid()
+            self.thread.start()
+    
+    def run(self):
+        while not self.stop_event.wait(self.app.config['VIEW_COUNT_FLUSH_INTERVAL']):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing view counts: {str(e)}")
+    
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, {}
+        if not batch:
+            return 0
+        
+        try:
+            with self.app.app_context():
+                for course_id, amount in batch.items():
+                    db.session.execute(
+                        db.update(Course)
+                        .where(Course.id == course_id)
+                        .values(view_count=db.func.coalesce(Course.view_count, 0) + amount)
+                    )
+                db.session.commit()
+        except Exception:
+            # Put the deltas back so the next flush retries them
+            with self.lock:
+                for course_id, amount in batch.items():
+                    self.pending[course_id] = self.pending.get(course_id, 0) + amount
+            raise
+        
+        flushed = sum(batch.values())
+        with self.lock:
+            self.flushed_total += flushed
+            self.flush_count += 1
+            self.last_flush_at = datetime.utcnow()
+        return flushed
+    
+    def stop(self):
+        self.stop_event.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing view counts at shutdown: {str(e)}")
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'pending_courses': len(self.pending),
+                'pending_views': sum(self.pending.values()),
+                'pending': {str(course_id): amount for course_id, amount in self.pending.items()},
+                'flushed_views': self.flushed_total,
+                'flush_count': self.flush_count,
+                'last_flush_at': self.last_flush_at.isoformat() if self.last_flush_at else None,
+                'flush_interval': self.app.config['VIEW_COUNT_FLUSH_INTERVAL']
+            }
+
+view_counter = app_service('view_counter')
+
+# Background activity log writer. Handlers enqueue events and a worker
+# thread bulk-inserts them in batches, so audit logging is never part of
+# request latency. ACTIVITY_LOG_SYNC writes each event inline instead,
+# which keeps tests deterministic.
+class ActivitySink:
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.queue = queue.Queue(maxsize=flask_app.config['ACTIVITY_LOG_QUEUE_SIZE'])
+        self.lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.thread = None
+        self.thread_pid = None
+        self.stop_event = threading.Event()
+    
+    def log(self, user_id, action_type, details=None, course_id=None):
+        event = {
+            'user_id': user_id,
+            'action_type': action_type,
+            'details': details,
+            'course_id': course_id,
+            'created_at': datetime.utcnow()
+        }
+        if self.app.config['ACTIVITY_LOG_SYNC']:
+            self.write_batch([event])
+            return
+        
+        self.ensure_started()
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Shed audit events rather than block the request
+            with self.lock:
+                self.dropped += 1
+    
+    def ensure_started(self):
+        # Threads don't survive fork, so each worker process starts its own writer
+        if self.thread is not None and self.thread_pid == os.getpid() and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is not None and self.thread_pid == os.getpid() and self.thread.is_alive():
+                return
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, name='activity-log-writer', daemon=True)
+            self.thread_pid = os.getpid()
+            self.thread.start()
+    
+    def run(self):
+        while not self.stop_event.is_set():
+            batch = self.next_batch()
+            if batch:
+                self.write_batch(batch)
+    
+    def next_batch(self):
+        # Collect up to ACTIVITY_LOG_BATCH_SIZE events, waiting at most ACTIVITY_LOG_FLUSH_MS
+        batch_size = self.app.config['ACTIVITY_LOG_BATCH_SIZE']
+        deadline = time.monotonic() + self.app.config['ACTIVITY_LOG_FLUSH_MS'] / 1000.0
+        batch = []
+        while len(batch) < batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+    
+    def write_batch(self, batch):
+        try:
+            with self.app.app_context():
+                db.session.execute(db.insert(ActivityLog), batch)
+                db.session.commit()
+        except Exception as e:
+            logger.error(f"Error writing {len(batch)} activity log events: {str(e)}")
+            with self.lock:
+                self.failed += len(batch)
+            return
+        with self.lock:
+            self.written += len(batch)
+            self.batches += 1
+    
+    def flush(self):
+        # Write everything queued so far from the calling thread
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.app.config['ACTIVITY_LOG_BATCH_SIZE']:
+                self.write_batch(batch)
+                batch = []
+        if batch:
+            self.write_batch(batch)
+    
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None and self.thread_pid == os.getpid():
+            self.thread.join(timeout=5)
+        self.flush()
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'queued': self.queue.qsize(),
+                'queue_capacity': self.queue.maxsize,
+                'written': self.written,
+                'batches': self.batches,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'sync': self.app.config['ACTIVITY_LOG_SYNC']
+            }
+
+activity_sink = app_service('activity_sink')
+
+# Password hashing service. Hashes run in a bounded process pool so a
+# login storm can't hold the GIL and starve other requests in the worker.
+# When more than PASSWORD_HASH_MAX_PENDING hashes are queued, callers get
+# PasswordHasherBusy (answered with 503) instead of waiting.
+class PasswordHasherBusy(Exception):
+    pass
+
+class PasswordHasher:
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.lock = threading.Lock()
+        self.pool = None
+        self.pool_pid = None
+        self.pending = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.latencies = {'hash': [], 'verify': []}
+        self.counts = {'hash': 0, 'verify': 0}
+        self.totals = {'hash': 0.0, 'verify': 0.0}
+        self.prefixes = {}
+    
+    def get_pool(self):
+        # Pools don't survive fork, so each worker process creates its own on first use
+        if self.pool is None or self.pool_pid != os.getpid():
+            self.pool = ProcessPoolExecutor(max_workers=self.app.config['PASSWORD_HASH_WORKERS'])
+            self.pool_pid = os.getpid()
+        return self.pool
+    
+    def run(self, kind, function, *args):
+        with self.lock:
+            if self.pending >= self.app.config['PASSWORD_HASH_MAX_PENDING']:
+                self.rejected += 1
+                raise PasswordHasherBusy()
+            self.pending += 1
+            if self.app.config['PASSWORD_HASH_WORKERS'] > 0:
+                pool = self.get_pool()
+        
+        started = time.perf_counter()
+        try:
+            if self.app.config['PASSWORD_HASH_WORKERS'] > 0:
+                return pool.submit(function, *args).result()
+            return function(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.pending -= 1
+                self.counts[kind] += 1
+                self.totals[kind] += elapsed
+                # Keep a window of recent latencies for percentiles
+                self.latencies[kind].append(elapsed)
+                if len(self.latencies[kind]) > 1000:
+                    del self.latencies[kind][:len(self.latencies[kind]) - 1000]
+    
+    def hash(self, password):
+        return self.run('hash', generate_password_hash, password, self.app.config['PASSWORD_HASH_METHOD'])
+    
+    def verify(self, stored_hash, password):
+        return self.run('verify', check_password_hash, stored_hash, password)
+    
+    def method_prefix(self):
+        # Shorthand specs ('scrypt', 'pbkdf2:sha256') are stored with their full parameters,
+        # so compare against the prefix of a real hash made once per process and method
+        method = self.app.config['PASSWORD_HASH_METHOD']
+        prefix = self.prefixes.get(method)
+        if prefix is None:
+            prefix = self.hash('').split('$', 1)[0]
+            with self.lock:
+                self.prefixes[method] = prefix
+        return prefix
+    
+    def needs_rehash(self, stored_hash):
+        return stored_hash.split('$', 1)[0] != self.method_prefix()
+    
+    def shutdown(self):
+        if self.pool is not None and self.pool_pid == os.getpid():
+            self.pool.shutdown(wait=False, cancel_futures=True)
+    
+    def stats(self):
+        with self.lock:
+            latency = {}
+            for kind, samples in self.latencies.items():
+                ordered = sorted(samples)
+                latency[kind] = {
+                    'count': self.counts[kind],
+                    'avg_ms': round(self.totals[kind] / self.counts[kind] * 1000, 2) if self.counts[kind] else 0,
+                    'p50_ms': round(ordered[len(ordered) // 2] * 1000, 2) if ordered else 0,
+                    'p95_ms': round(ordered[int(len(ordered) * 0.95)] * 1000, 2) if ordered else 0,
+                    'max_ms': round(ordered[-1] * 1000, 2) if ordered else 0
+                }
+            return {
+                'method': self.app.config['PASSWORD_HASH_METHOD'],
+                'workers': self.app.config['PASSWORD_HASH_WORKERS'],
+                'queue_depth': self.pending,
+                'max_pending': self.app.config['PASSWORD_HASH_MAX_PENDING'],
+                'rejected': self.rejected,
+                'rehashed': self.rehashed,
+                'latency': latency
+            }
+
+password_hasher = app_service('password_hasher')
+
+# Authenticated-user cache. Decoded JWT payloads are cached by token and
+# user rows by id (as plain column snapshots), so an authenticated request
+# usually costs neither a signature check nor a primary-key lookup. Handlers
+# that change a user must call auth_cache.invalidate_user(); the TTL bounds
+# staleness across worker processes.
+class AuthCache:
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.lock = threading.Lock()
+        self.tokens = OrderedDict()
+        self.users = OrderedDict()
+        self.token_hits = 0
+        self.token_misses = 0
+        self.user_hits = 0
+        self.user_misses = 0
+    
+    def get_entry(self, store, key):
+        with self.lock:
+            entry = store.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del store[key]
+                return None
+            store.move_to_end(key)
+            return value
+    
+    def put_entry(self, store, key, value):
+        ttl = self.app.config['AUTH_CACHE_TTL']
+        if ttl <= 0:
+            return
+        with self.lock:
+            store[key] = (time.monotonic() + ttl, value)
+            store.move_to_end(key)
+            while len(store) > self.app.config['AUTH_CACHE_SIZE']:
+                store.popitem(last=False)
+    
+    def decode_token(self, token):
+        payload = self.get_entry(self.tokens, token)
+        # A cached payload is only good until the token itself expires
+        if payload is not None and payload.get('exp', 0) > time.time():
+            with self.lock:
+                self.token_hits += 1
+            return payload
+        
+        with self.lock:
+            self.token_misses += 1
+        payload = jwt.decode(token, self.app.secret_key, algorithms=["HS256"])
+        self.put_entry(self.tokens, token, payload)
+        return payload
+    
+    def load_user(self, user_id):
+        snapshot = self.get_entry(self.users, user_id)
+        if snapshot is not None:
+            with self.lock:
+                self.user_hits += 1
+            # Rebuild the row and attach it to this request's session without a SELECT,
+            # so handlers can still modify and commit it
+            user = User(**copy.deepcopy(snapshot))
+            make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
+        
+        with self.lock:
+            self.user_misses += 1
+        user = db.session.get(User, user_id)
+        if user:
+            self.put_entry(self.users, user_id, {
+                column.key: copy.deepcopy(getattr(user, column.key)) for column in User.__table__.columns
+            })
+        return user
+    
+    def invalidate_user(self, user_id):
+        with self.lock:
+            self.users.pop(user_id, None)
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'token_hits': self.token_hits,
+                'token_misses': self.token_misses,
+                'user_hits': self.user_hits,
+                'user_misses': self.user_misses,
+                'cached_tokens': len(self.tokens),
+                'cached_users': len(self.users),
+                'ttl': self.app.config['AUTH_CACHE_TTL'],
+                'max_size': self.app.config['AUTH_CACHE_SIZE']
+            }
+
+auth_cache = app_service('auth_cache')
+
+# Catalog response cache. Serialized catalog responses are kept per route
+# and query string, tagged with the catalog version that produced them.
+# Course and resource writes call catalog_cache.bump(), which retires every
+# entry. Other worker processes don't see the bump, so entries also expire
+# after CATALOG_CACHE_TTL seconds.
+class CatalogCache:
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.lock = threading.Lock()
+        self.version = 0
+        self.bumped_at = None
+        self.entries = OrderedDict()
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry['version'] != self.version or entry['expires_at'] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+    
+    def put(self, key, body, mimetype, version, store=True):
+        entry = {
+            'body': body,
+            'mimetype': mimetype,
+            'etag': hashlib.sha256(body).hexdigest(),
+            'version': version,
+            'expires_at': time.monotonic() + self.app.config['CATALOG_CACHE_TTL']
+        }
+        with self.lock:
+            # Don't store a response built from data a concurrent write already retired
+            if store and version == self.version and self.app.config['CATALOG_CACHE_TTL'] > 0:
+                self.entries[key] = entry
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.app.config['CATALOG_CACHE_SIZE']:
+                    self.entries.popitem(last=False)
+        return entry
+    
+    def bump(self):
+        with self.lock:
+            self.version += 1
+            self.bumped_at = time.monotonic()
+            self.entries.clear()
+    
+    def changed_within(self, seconds):
+        with self.lock:
+            return self.bumped_at is not None and time.monotonic() - self.bumped_at < seconds
+
+catalog_cache = app_service('catalog_cache')
+
+def catalog_cached(f):
+    """Serve a catalog GET from catalog_cache with a strong ETag, answering If-None-Match with 304."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        # Entries may have been built from a replica; a user pinned to the primary gets a fresh read
+        if current_app.config['DATABASE_REPLICA_URLS'] and replica_router.pinned_to_primary():
+            return f(*args, **kwargs)
+        
+        key = request.path + '?' + urlencode(sorted(request.args.items(multi=True)))
+        if wants_msgpack():
+            key += '#msgpack'
+        entry = catalog_cache.get(key)
+        if entry is None:
+            version = catalog_cache.version
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            # Right after a catalog write a replica may still serve the old data; don't cache it
+            lagging = bool(db.session.info.get('replica')) and catalog_cache.changed_within(
+                current_app.config['READ_REPLICA_STICKY_SECONDS'])
+            entry = catalog_cache.put(key, response.get_data(), response.mimetype, version, store=not lagging)
+        
+        response = current_app.response_class(entry['body'], mimetype=entry['mimetype'])
+        response.vary.add('Accept')
+        if is_compressible(entry['mimetype']):
+            response.vary.add('Accept-Encoding')
+        # The ETag of the body as it will be sent, so 304s carry the same one as 200s
+        response.set_etag(encoded_etag(entry['etag'], negotiated_encoding(len(entry['body']), entry['mimetype'])))
+        # Let clients keep the body but revalidate it on every use
+        response.headers['Cache-Control'] = 'public, no-cache'
+        return response.make_conditional(request)
+    
+    return decorated
+
+# Request metrics. Every request records its latency, response size and the
+# number and total duration of SQL statements it ran (counted by engine event
+# hooks). Histograms are kept per process and rendered in Prometheus text
+# format by /api/metrics; label endpoints by route rule, not raw path, so the
+# series count stays bounded.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SLOW_REQUEST_MAX_STATEMENTS = 50
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+    
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+    
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+def prometheus_labels(**labels):
+    escaped = {key: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for key, value in labels.items()}
+    return ','.join(f'{key}="{value}"' for key, value in escaped.items())
+
+class RequestMetrics:
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.requests = {}  # (endpoint, method, status) -> count
+        self.series = {}  # (endpoint, method) -> dict of histograms and DB counters
+        self.slow_requests = 0
+    
+    def record(self, endpoint, method, status, duration, size, statements, db_time):
+        with self.lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            series = self.series.get((endpoint, method))
+            if series is None:
+                series = self.series[(endpoint, method)] = {
+                    'duration': Histogram(LATENCY_BUCKETS),
+                    'size': Histogram(SIZE_BUCKETS),
+                    'statements': Histogram(QUERY_COUNT_BUCKETS),
+                    'db_time': 0.0
+                }
+            series['duration'].observe(duration)
+            if size is not None:
+                series['size'].observe(size)
+            series['statements'].observe(statements)
+            series['db_time'] += db_time
+    
+    def render(self):
+        with self.lock:
+            lines = [
+                '# HELP http_requests_total Requests handled, by route, method and status code.',
+                '# TYPE http_requests_total counter'
+            ]
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{{prometheus_labels(endpoint=endpoint, method=method, status=status)}}} {count}')
+            
+            for name, key, kind, help_text in (
+                ('http_request_duration_seconds', 'duration', 'histogram', 'Request latency.'),
+                ('http_response_size_bytes', 'size', 'histogram', 'Response body size (streamed responses excluded).'),
+                ('db_statements_per_request', 'statements', 'histogram', 'SQL statements executed per request.'),
+                ('db_time_seconds_total', 'db_time', 'counter', 'Time spent executing SQL statements.')
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for (endpoint, method), series in sorted(self.series.items()):
+                    labels = prometheus_labels(endpoint=endpoint, method=method)
+                    if kind == 'histogram':
+                        lines.extend(series[key].render(name, labels))
+                    else:
+                        lines.append(f'{name}{{{labels}}} {series[key]}')
+            
+            lines.extend([
+                '# HELP slow_requests_total Requests slower than SLOW_REQUEST_MS.',
+                '# TYPE slow_requests_total counter',
+                f'slow_requests_total {self.slow_requests}',
+                '# HELP process_start_time_seconds Start time of the process since the Unix epoch.',
+                '# TYPE process_start_time_seconds gauge',
+                f'process_start_time_seconds {self.started_at}'
+            ])
+        return '\n'.join(lines) + '\n'
+
+request_metrics = app_service('request_metrics')
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['statement_started'].pop()
+    # Background writers run outside any request and aren't attributed to one
+    if not has_request_context() or 'sql_count' not in g:
+        return
+    g.sql_count += 1
+    g.sql_time += elapsed
+    if current_app.config['SLOW_REQUEST_MS'] > 0 and len(g.sql_statements) < SLOW_REQUEST_MAX_STATEMENTS:
+        g.sql_statements.append((elapsed, statement))
+
+@event.listens_for(Engine, 'handle_error')
+def discard_statement_timer(exception_context):
+    if exception_context.connection is not None and exception_context.connection.info.get('statement_started'):
+        exception_context.connection.info['statement_started'].pop()
+
+@api.before_app_request
+def start_request_metrics():
+    if not current_app.config['METRICS_ENABLED'] and current_app.config['SLOW_REQUEST_MS'] <= 0:
+        return
+    g.request_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+    g.sql_statements = []
+
+@api.after_app_request
+def finish_request_metrics(response):
+    if 'request_started' not in g:
+        return response
+    duration = time.perf_counter() - g.request_started
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    # Streamed and file responses have no length up front; don't buffer them to find out
+    size = None if response.is_streamed else response.calculate_content_length()
+    
+    if current_app.config['METRICS_ENABLED']:
+        request_metrics.record(endpoint, request.method, response.status_code, duration, size,
+                               g.sql_count, g.sql_time)
+    
+    if 0 < current_app.config['SLOW_REQUEST_MS'] <= duration * 1000:
+        with request_metrics.lock:
+            request_metrics.slow_requests += 1
+        statements = ''.join(
+            f"\n    [{elapsed * 1000:.1f} ms] {' '.join(statement.split())}"
+            for elapsed, statement in sorted(g.sql_statements, key=lambda item: item[0], reverse=True)
+        )
+        logger.warning("Slow request: %s %s -> %s in %.1f ms, %d SQL statements (%.1f ms)%s",
+                       request.method, request.full_path.rstrip('?'), response.status_code,
+                       duration * 1000, g.sql_count, g.sql_time * 1000, statements)
+    return response
+
+# Response compression. Registered after the metrics hook so it runs first
+# (after_request hooks run in reverse) and the metrics see the bytes sent.
+# Uploaded media is served as-is: it is usually compressed already, and
+# rewriting it would defeat range requests and proxy offload.
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/msgpack', 'application/javascript',
+                          'application/xml', 'image/svg+xml', 'text/')
+
+class CompressionCache:
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+    
+    def compress(self, body, encoding):
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.app.config['COMPRESSION_BROTLI_QUALITY'])
+        return gzip.compress(body, compresslevel=self.app.config['COMPRESSION_GZIP_LEVEL'], mtime=0)
+    
+    def get(self, etag, body, encoding):
+        key = (etag, encoding) if etag else None
+        if key is not None:
+            with self.lock:
+                compressed = self.entries.get(key)
+                if compressed is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    self.bytes_in += len(body)
+                    self.bytes_out += len(compressed)
+                    return compressed
+        
+        compressed = self.compress(body, encoding)
+        with self.lock:
+            self.misses += 1
+            self.bytes_in += len(body)
+            self.bytes_out += len(compressed)
+            if key is not None and self.app.config['COMPRESSION_CACHE_SIZE'] > 0:
+                self.entries[key] = compressed
+                while len(self.entries) > self.app.config['COMPRESSION_CACHE_SIZE']:
+                    self.entries.popitem(last=False)
+        return compressed
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'cached_responses': len(self.entries),
+                'max_size': self.app.config['COMPRESSION_CACHE_SIZE'],
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'ratio': round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+                'encodings': ['br', 'gzip'] if brotli else ['gzip']
+            }
+
+compression_cache = app_service('compression_cache')
+
+def is_compressible(mimetype):
+    return current_app.config['COMPRESSION_ENABLED'] and mimetype.startswith(COMPRESSIBLE_MIMETYPES)
+
+def negotiated_encoding(body_length, mimetype):
+    """The Content-Encoding compress_response() gives a 200 response with this body, or None."""
+    if not is_compressible(mimetype) or body_length < current_app.config['COMPRESSION_MIN_SIZE']:
+        return None
+    return request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+
+def encoded_etag(etag, encoding):
+    # Each encoding is a different byte sequence, so it gets its own strong ETag
+    return f'{etag}-{encoding}' if encoding else etag
+
+@api.after_app_request
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or request.path.startswith('/uploads/')
+            or not is_compressible(response.mimetype)):
+        return response
+    
+    # The body depends on Accept-Encoding even when this client gets it uncompressed
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    encoding = negotiated_encoding(len(body), response.mimetype)
+    if encoding is None:
+        return response
+    
+    # catalog_cached() already sets the ETag of the encoded body; the cache is keyed by the entity's
+    etag, weak = response.get_etag()
+    if etag and etag.endswith(f'-{encoding}'):
+        etag = etag[:-len(f'-{encoding}')]
+    response.set_data(compression_cache.get(etag, body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag(encoded_etag(etag, encoding), weak=weak)
+    return response
+
 # JWT token authentication
 def token_required(f):
     # ... keep existing code (token_required function)
@@ -162,8 +1870,8 @@ def token_required(f):
             return jsonify({'message': 'Token is missing!'}), 401
         
         try:
-            data = jwt.decode(token, app.secret_key, algorithms=["HS256"])
-            current_user = User.query.get(data['user_id'])
+            data = auth_cache.decode_token(token)
+            current_user = auth_cache.load_user(data['user_id'])
             if not current_user:
                 raise Exception("User not found")
         except Exception as e:
@@ -174,7 +1882,7 @@ def token_required(f):
     return decorated
 
 # Add a health check endpoint
-@app.route('/api/health-check', methods=['GET', 'OPTIONS'])
+@api.route('/api/health-check', methods=['GET', 'OPTIONS'])
 def health_check():
     # Handle OPTIONS request for CORS preflight
     if request.method == 'OPTIONS':
@@ -187,7 +1895,7 @@ def health_check():
     }), 200
 
 # Routes for authentication
-@app.route('/api/auth/register', methods=['POST'])
+@api.route('/api/auth/register', methods=['POST'])
 def register_user():
     # ... keep existing code (register_user function)
     data = request.get_json()
@@ -201,7 +1909,10 @@ def register_user():
         return jsonify({'message': 'User already exists'}), 409
     
     # Create new user
-    hashed_password = generate_password_hash(data['password'])
+    try:
+        hashed_password = password_hasher.hash(data['password'])
+    except PasswordHasherBusy:
+        return jsonify({'message': 'Server is busy, please try again shortly'}), 503, {'Retry-After': '1'}
     new_user = User(
         email=data['email'],
         password=hashed_password,
@@ -210,21 +1921,20 @@ def register_user():
     )
     
     db.session.add(new_user)
+    bump_stats({'total_users': 1, f"new_users:{datetime.utcnow().date().isoformat()}": 1})
     db.session.commit()
     
     # Log the activity
-    log_activity = ActivityLog(
+    activity_sink.log(
         user_id=new_user.id,
         action_type='registration',
         details=f"User {new_user.email} registered"
     )
-    db.session.add(log_activity)
-    db.session.commit()
     
     return jsonify({'message': 'User registered successfully'}), 201
 
 # ... keep existing code (all other route handlers)
-@app.route('/api/auth/login', methods=['POST'])
+@api.route('/api/auth/login', methods=['POST'])
 def login_user():
     data = request.get_json()
     
@@ -233,41 +1943,52 @@ def login_user():
     
     user = User.query.filter_by(email=data['email']).first()
     
-    if not user or not check_password_hash(user.password, data['password']):
-        return jsonify({'message': 'Invalid credentials'}), 401
+    try:
+        if not user or not password_hasher.verify(user.password, data['password']):
+            return jsonify({'message': 'Invalid credentials'}), 401
+        
+        # Upgrade hashes made with older algorithm or cost settings while the plain password is at hand
+        if password_hasher.needs_rehash(user.password):
+            user.password = password_hasher.hash(data['password'])
+            with password_hasher.lock:
+                password_hasher.rehashed += 1
+    except PasswordHasherBusy:
+        return jsonify({'message': 'Server is busy, please try again shortly'}), 503, {'Retry-After': '1'}
     
-    # Update last login time
-    user.last_login = datetime.utcnow()
+    # Update last login time, counting the user once per day in the dashboard stats
+    now = datetime.utcnow()
+    if not user.last_login or user.last_login.date() != now.date():
+        bump_stats({f"logins:{now.date().isoformat()}": 1})
+    user.last_login = now
     db.session.commit()
+    auth_cache.invalidate_user(user.id)
     
     # Log the activity
-    log_activity = ActivityLog(
+    activity_sink.log(
         user_id=user.id,
         action_type='login',
         details=f"User {user.email} logged in"
     )
-    db.session.add(log_activity)
-    db.session.commit()
     
     # Generate JWT token
     token = jwt.encode({
         'user_id': user.id,
         'exp': datetime.utcnow() + timedelta(hours=24)
-    }, app.secret_key, algorithm="HS256")
+    }, current_app.secret_key, algorithm="HS256")
     
     return jsonify({
         'token': token,
         'user': user.to_dict()
     }), 200
 
-@app.route('/api/auth/current-user', methods=['GET'])
+@api.route('/api/auth/current-user', methods=['GET'])
 @token_required
 def get_current_user(current_user):
     return jsonify({
         'user': current_user.to_dict()
     }), 200
 
-@app.route('/api/auth/users/<int:user_id>/metadata', methods=['PUT'])
+@api.route('/api/auth/users/<int:user_id>/metadata', methods=['PUT'])
 @token_required
 def update_user_metadata(current_user, user_id):
     # ... keep existing code (update_user_metadata function)
@@ -293,6 +2014,7 @@ def update_user_metadata(current_user, user_id):
             user.user_metadata = data['metadata']  # Changed from user.metadata to user.user_metadata
         
         db.session.commit()
+        auth_cache.invalidate_user(user.id)
         
         return jsonify({
             'message': 'User metadata updated successfully',
@@ -303,7 +2025,7 @@ def update_user_metadata(current_user, user_id):
         logger.error(f"Error updating user metadata: {str(e)}")
         return jsonify({'message': f'Error updating metadata: {str(e)}'}), 500
 
-@app.route('/api/auth/users/<int:user_id>/apply-teacher', methods=['POST'])
+@api.route('/api/auth/users/<int:user_id>/apply-teacher', methods=['POST'])
 @token_required
 def apply_as_teacher(current_user, user_id):
     # ... keep existing code (apply_as_teacher function)
@@ -334,136 +2056,769 @@ def apply_as_teacher(current_user, user_id):
         current_user.role = 'teacher'
         
         # Log the activity
-        log_activity = ActivityLog(
+        activity_sink.log(
             user_id=current_user.id,
             action_type='teacher_application',
             details=f"User applied to become a teacher: {current_user.email}"
         )
-        db.session.add(log_activity)
         
         db.session.commit()
+        auth_cache.invalidate_user(current_user.id)
         
         return jsonify({
             'message': 'Teacher application submitted successfully and role updated to teacher',
             'user': current_user.to_dict()
         }), 200
     except Exception as e:
-        db.session.rollback()
-        logger.error(f"Error submitting teacher application: {str(e)}")
-        return jsonify({'message': f'Error submitting application: {str(e)}'}), 500
+        db.session.rollback()
+        logger.error(f"Error submitting teacher application: {str(e)}")
+        return jsonify({'message': f'Error submitting application: {str(e)}'}), 500
+
+# Upload helpers shared by the single-request and chunked upload endpoints
+def build_upload_filename(current_user, filename, course_id, course_title):
+    """Return (original_filename, unique_filename) for an uploaded file."""
+    original_filename = secure_filename(filename)
+    file_extension = os.path.splitext(original_filename)[1]
+    
+    # Create a sanitized username and course title for the filename
+    username_part = secure_filename(current_user.username or 'user').lower()[:20]
+    course_part = ''
+    if course_title:
+        course_part = secure_filename(course_title).lower()[:30]
+    elif course_id and course_id.isdigit():
+        course = Course.query.get(int(course_id))
+        if course:
+            course_part = secure_filename(course.title).lower()[:30]
+    
+    # Replace spaces with underscores for all parts
+    username_part = username_part.replace(' ', '_')
+    course_part = course_part.replace(' ', '_')
+    
+    # Create unique descriptive filename
+    timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    random_suffix = uuid.uuid4().hex[:8]  # 8 chars from UUID for uniqueness
+    
+    if course_part:
+        unique_filename = f"{username_part}_{course_part}_{timestamp}_{random_suffix}{file_extension}"
+    else:
+        unique_filename = f"{username_part}_{timestamp}_{random_suffix}{file_extension}"
+    
+    return original_filename, unique_filename
+
+def find_upload_course(course_id):
+    if course_id and course_id.isdigit():
+        return db.session.get(Course, int(course_id))
+    return None
+
+def new_upload_temp_path():
+    # Temp files live next to the upload sessions, outside the served folder
+    return os.path.join(current_app.config['UPLOAD_SESSIONS_FOLDER'], f'{uuid.uuid4().hex}.tmp')
+
+def write_stream_hashed(stream, path):
+    """Copy stream to path, returning (sha256 hex digest, size)."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'wb') as output:
+        while True:
+            block = stream.read(STREAM_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            output.write(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+def store_blob(temp_path, blob_hash, extension):
+    """Move a hashed temp file into the blob store and return its URL.
+
+    If a blob with the same content already exists the temp file is discarded.
+    """
+    extension = extension.lower()
+    blob_dir = os.path.join(upload_subfolder(BLOBS_SUBFOLDER), blob_hash[:2])
+    os.makedirs(blob_dir, exist_ok=True)
+    blob_path = os.path.join(blob_dir, blob_hash)
+    if os.path.exists(blob_path):
+        os.remove(temp_path)
+        # Refresh the mtime so a concurrent garbage collection keeps the blob
+        os.utime(blob_path)
+    else:
+        shutil.move(temp_path, blob_path)
+    return f"/uploads/blobs/{blob_hash[:2]}/{blob_hash}{extension}"
+
+def collect_unreferenced_blobs(dry_run=False):
+    """Delete blobs (and their derivatives) no CourseResource references. Returns (removed count, freed bytes)."""
+    referenced = {row[0] for row in db.session.query(CourseResource.blob_hash).filter(
+        CourseResource.blob_hash.isnot(None)).distinct()}
+    # Skip recent blobs whose upload may not have committed its CourseResource yet
+    cutoff = time.time() - current_app.config['BLOB_GC_GRACE_SECONDS']
+    removed = 0
+    freed = 0
+    # Derivatives are named <blob hash>_<variant>.<ext> and go with their blob
+    blob_folder = upload_subfolder(BLOBS_SUBFOLDER)
+    for folder in (blob_folder, upload_subfolder(DERIVATIVES_SUBFOLDER)):
+        if not os.path.isdir(folder):
+            continue
+        for prefix in os.listdir(folder):
+            prefix_path = os.path.join(folder, prefix)
+            if not os.path.isdir(prefix_path):
+                continue
+            names = set(os.listdir(prefix_path))
+            for name in names:
+                blob_hash = os.path.splitext(name)[0].split('_')[0]
+                blob_path = os.path.join(prefix_path, name)
+                # Blobs stored by older versions kept the extension; once the
+                # same content is stored as <sha256> that copy is never served
+                superseded = folder == blob_folder and name != blob_hash and blob_hash in names
+                if (blob_hash in referenced and not superseded) or os.path.getmtime(blob_path) > cutoff:
+                    continue
+                freed += os.path.getsize(blob_path)
+                removed += 1
+                if not dry_run:
+                    os.remove(blob_path)
+    return removed, freed
+
+
+@api.cli.command('gc-blobs')
+@click.option('--dry-run', is_flag=True, help='Only report what would be removed.')
+def gc_blobs_command(dry_run):
+    """Remove stored upload blobs that no course resource references any more."""
+    removed, freed = collect_unreferenced_blobs(dry_run=dry_run)
+    verb = 'Would remove' if dry_run else 'Removed'
+    print(f"{verb} {removed} unreferenced blobs ({freed} bytes)")
+
+def record_upload(current_user, course, original_filename, file_type, file_url, size, blob_hash=None,
+                  upload_session=None):
+    # Add record to the database if this is a course resource. A completed upload
+    # session is marked complete in the same transaction.
+    if upload_session is not None:
+        upload_session.status = 'complete'
+        upload_session.file_url = file_url
+        upload_session.completed_at = datetime.utcnow()
+    if course:
+        resource = CourseResource(
+            course_id=course.id,
+            name=original_filename,
+            type=file_type,
+            url=file_url,
+            size=size,
+            blob_hash=blob_hash,
+            processing_status='pending'
+        )
+        db.session.add(resource)
+        db.session.flush()
+        # Derivatives and metadata are generated later by the media worker
+        db.session.add(MediaJob(resource_id=resource.id))
+    db.session.commit()
+    if course:
+        catalog_cache.bump()
+    
+    # Log the activity
+    activity_sink.log(
+        user_id=current_user.id,
+        action_type='file_upload',
+        details=f"User uploaded file: {original_filename}",
+        course_id=course.id if course else None
+    )
+
+@api.route('/api/upload', methods=['POST'])
+@token_required
+def upload_file(current_user):
+    # ... keep existing code (upload_file function)
+    try:
+        # Check if file is included in the request
+        if 'file' not in request.files:
+            return jsonify({'message': 'No file part'}), 400
+        
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'message': 'No selected file'}), 400
+        
+        # Get type and folder from form data
+        file_type = request.form.get('type', 'other')
+        folder = request.form.get('folder', 'general')
+        course_id = request.form.get('course_id')
+        course_title = request.form.get('course_title', '')
+        
+        course = find_upload_course(course_id)
+        if course:
+            # Course resources are stored by content hash, so re-uploads of the same file share one blob
+            original_filename = secure_filename(file.filename)
+            temp_path = new_upload_temp_path()
+            blob_hash, size = write_stream_hashed(file.stream, temp_path)
+            file_url = store_blob(temp_path, blob_hash, os.path.splitext(original_filename)[1])
+        else:
+            # Create folder path
+            folder_path = os.path.join(current_app.config['UPLOAD_FOLDER'], folder)
+            os.makedirs(folder_path, exist_ok=True)
+            
+            # Generate a descriptive filename that's still unique
+            original_filename, unique_filename = build_upload_filename(current_user, file.filename, course_id, course_title)
+            
+            # Save the file
+            file_path = os.path.join(folder_path, unique_filename)
+            file.save(file_path)
+            
+            # Create relative URL path for the file
+            file_url = f"/uploads/{folder}/{unique_filename}"
+            blob_hash = None
+            size = os.path.getsize(file_path)
+        
+        record_upload(current_user, course, original_filename, file_type, file_url, size, blob_hash)
+        
+        return jsonify({
+            'message': 'File uploaded successfully',
+            'fileUrl': file_url,
+            'originalName': original_filename,
+            'type': file_type
+        }), 201
+        
+    except Exception as e:
+        logger.error(f"Error uploading file: {str(e)}")
+        return jsonify({'message': f'Error uploading file: {str(e)}'}), 500
+
+# Resumable chunked uploads: create a session, PUT numbered chunks (in any
+# order, possibly in parallel), check which byte ranges have arrived, then
+# complete the session to assemble the file and record it like /api/upload.
+STREAM_BLOCK_SIZE = 64 * 1024
+
+def get_upload_session(current_user, session_id):
+    upload_session = db.session.get(UploadSession, session_id)
+    if not upload_session or upload_session.user_id != current_user.id:
+        return None
+    return upload_session
+
+@api.route('/api/uploads/sessions', methods=['POST'])
+@token_required
+def create_upload_session(current_user):
+    data = request.get_json()
+    if not data or not data.get('fileName') or 'size' not in data:
+        return jsonify({'message': 'Missing fileName or size'}), 400
+    
+    try:
+        total_size = int(data['size'])
+        chunk_size = int(data.get('chunkSize', current_app.config['UPLOAD_CHUNK_SIZE']))
+    except (TypeError, ValueError):
+        return jsonify({'message': 'size and chunkSize must be integers'}), 400
+    
+    if total_size <= 0 or total_size > current_app.config['UPLOAD_SESSION_MAX_SIZE']:
+        return jsonify({'message': f"size must be between 1 and {current_app.config['UPLOAD_SESSION_MAX_SIZE']} bytes"}), 400
+    if chunk_size <= 0 or chunk_size > current_app.config['UPLOAD_MAX_CHUNK_SIZE']:
+        return jsonify({'message': f"chunkSize must be between 1 and {current_app.config['UPLOAD_MAX_CHUNK_SIZE']} bytes"}), 400
+    
+    checksum = data.get('checksum')
+    if checksum and not re.fullmatch(r'[0-9a-fA-F]{64}', checksum):
+        return jsonify({'message': 'checksum must be a hex SHA-256 digest'}), 400
+    
+    open_sessions = UploadSession.query.filter_by(user_id=current_user.id, status='open').count()
+    if open_sessions >= current_app.config['UPLOAD_MAX_OPEN_SESSIONS']:
+        return jsonify({'message': f"Too many open upload sessions (at most {current_app.config['UPLOAD_MAX_OPEN_SESSIONS']}); "
+                                   "complete or abort one first"}), 429
+    
+    course_id = data.get('course_id')
+    upload_session = UploadSession(
+        user_id=current_user.id,
+        filename=data['fileName'],
+        file_type=data.get('type', 'other'),
+        folder=data.get('folder', 'general'),
+        course_id=str(course_id) if course_id is not None else None,
+        course_title=data.get('course_title', ''),
+        total_size=total_size,
+        chunk_size=chunk_size,
+        checksum=checksum.lower() if checksum else None
+    )
+    db.session.add(upload_session)
+    db.session.commit()
+    os.makedirs(upload_session.staging_path, exist_ok=True)
+    
+    return jsonify(upload_session.to_dict()), 201
+
+@api.route('/api/uploads/sessions/<session_id>', methods=['GET'])
+@token_required
+def get_upload_session_status(current_user, session_id):
+    upload_session = get_upload_session(current_user, session_id)
+    if not upload_session:
+        return jsonify({'message': 'Upload session not found'}), 404
+    
+    return jsonify(upload_session.to_dict()), 200
+
+@api.route('/api/uploads/sessions/<session_id>/chunks/<int:index>', methods=['PUT'])
+@token_required
+def upload_chunk(current_user, session_id, index):
+    upload_session = get_upload_session(current_user, session_id)
+    if not upload_session:
+        return jsonify({'message': 'Upload session not found'}), 404
+    if upload_session.status != 'open':
+        return jsonify({'message': f'Upload session is {upload_session.status}'}), 409
+    if index < 0 or index >= upload_session.total_chunks:
+        return jsonify({'message': f'Chunk index must be between 0 and {upload_session.total_chunks - 1}'}), 400
+    
+    expected_length = upload_session.chunk_length(index)
+    chunk_path = os.path.join(upload_session.staging_path, f'{index}.part')
+    temp_path = f'{chunk_path}.{uuid.uuid4().hex}.tmp'
+    digest = hashlib.sha256()
+    written = 0
+    
+    try:
+        # Stream the body straight to disk; the chunk only becomes visible once complete
+        with open(temp_path, 'wb') as chunk_file:
+            while True:
+                block = request.stream.read(STREAM_BLOCK_SIZE)
+                if not block:
+                    break
+                written += len(block)
+                if written > expected_length:
+                    break
+                digest.update(block)
+                chunk_file.write(block)
+        
+        if written != expected_length:
+            os.remove(temp_path)
+            return jsonify({'message': f'Chunk {index} must be exactly {expected_length} bytes'}), 400
+        
+        expected_checksum = request.headers.get('X-Chunk-SHA256')
+        if expected_checksum and expected_checksum.lower() != digest.hexdigest():
+            os.remove(temp_path)
+            return jsonify({'message': f'Checksum mismatch for chunk {index}'}), 400
+        
+        os.replace(temp_path, chunk_path)
+    except Exception as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        logger.error(f"Error receiving chunk {index} of upload session {session_id}: {str(e)}")
+        return jsonify({'message': f'Error receiving chunk: {str(e)}'}), 500
+    
+    return jsonify({
+        'index': index,
+        'size': written,
+        'sha256': digest.hexdigest()
+    }), 200
 
-@app.route('/api/upload', methods=['POST'])
+@api.route('/api/uploads/sessions/<session_id>/complete', methods=['POST'])
 @token_required
-def upload_file(current_user):
-    # ... keep existing code (upload_file function)
+def complete_upload_session(current_user, session_id):
+    upload_session = get_upload_session(current_user, session_id)
+    if not upload_session:
+        return jsonify({'message': 'Upload session not found'}), 404
+    
+    missing = upload_session.to_dict()['missingChunks']
+    if upload_session.status == 'open' and missing:
+        return jsonify({'message': 'Upload is incomplete', 'missingChunks': missing}), 400
+    
+    # Claim the session so concurrent completions can't assemble it twice
+    claimed = db.session.execute(
+        db.update(UploadSession)
+        .where(UploadSession.id == upload_session.id, UploadSession.status == 'open')
+        .values(status='finalizing')
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return jsonify({'message': f'Upload session is {upload_session.status}'}), 409
+    
+    temp_path = os.path.join(upload_session.staging_path, 'assembled.tmp')
+    stored_path = None
     try:
-        # Check if file is included in the request
-        if 'file' not in request.files:
-            return jsonify({'message': 'No file part'}), 400
+        # Assemble the chunks in order, hashing the whole file as it is written
+        digest = hashlib.sha256()
+        size = 0
+        with open(temp_path, 'wb') as output:
+            for index in range(upload_session.total_chunks):
+                with open(os.path.join(upload_session.staging_path, f'{index}.part'), 'rb') as chunk_file:
+                    while True:
+                        block = chunk_file.read(STREAM_BLOCK_SIZE)
+                        if not block:
+                            break
+                        digest.update(block)
+                        output.write(block)
+                        size += len(block)
         
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'message': 'No selected file'}), 400
-        
-        # Get type and folder from form data
-        file_type = request.form.get('type', 'other')
-        folder = request.form.get('folder', 'general')
-        course_id = request.form.get('course_id')
-        course_title = request.form.get('course_title', '')
+        checksum = digest.hexdigest()
+        if upload_session.checksum and upload_session.checksum != checksum:
+            os.remove(temp_path)
+            upload_session.status = 'open'
+            db.session.commit()
+            return jsonify({'message': 'Checksum mismatch for assembled file', 'sha256': checksum}), 400
         
-        # Create folder path
-        folder_path = os.path.join(app.config['UPLOAD_FOLDER'], folder)
-        os.makedirs(folder_path, exist_ok=True)
-        
-        # Generate a descriptive filename that's still unique
-        original_filename = secure_filename(file.filename)
-        file_extension = os.path.splitext(original_filename)[1]
-        
-        # Create a sanitized username and course title for the filename
-        username_part = secure_filename(current_user.username or 'user').lower()[:20]
-        course_part = ''
-        if course_title:
-            course_part = secure_filename(course_title).lower()[:30]
-        elif course_id and course_id.isdigit():
-            course = Course.query.get(int(course_id))
-            if course:
-                course_part = secure_filename(course.title).lower()[:30]
-        
-        # Replace spaces with underscores for all parts
-        username_part = username_part.replace(' ', '_')
-        course_part = course_part.replace(' ', '_')
-        
-        # Create unique descriptive filename
-        timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-        random_suffix = uuid.uuid4().hex[:8]  # 8 chars from UUID for uniqueness
-        
-        if course_part:
-            unique_filename = f"{username_part}_{course_part}_{timestamp}_{random_suffix}{file_extension}"
+        course = find_upload_course(upload_session.course_id)
+        if course:
+            original_filename = secure_filename(upload_session.filename)
+            file_url = store_blob(temp_path, checksum, os.path.splitext(original_filename)[1])
+            blob_hash = checksum
         else:
-            unique_filename = f"{username_part}_{timestamp}_{random_suffix}{file_extension}"
-        
-        # Save the file
-        file_path = os.path.join(folder_path, unique_filename)
-        file.save(file_path)
-        
-        # Create relative URL path for the file
-        file_url = f"/uploads/{folder}/{unique_filename}"
-        
-        # Add record to the database if this is a course resource
-        if course_id and course_id.isdigit():
-            course = Course.query.get(int(course_id))
-            if course:
-                resource = CourseResource(
-                    course_id=int(course_id),
-                    name=original_filename,
-                    type=file_type,
-                    url=file_url,
-                    size=os.path.getsize(file_path)
-                )
-                db.session.add(resource)
-                db.session.commit()
+            # Create folder path
+            folder_path = os.path.join(current_app.config['UPLOAD_FOLDER'], upload_session.folder)
+            os.makedirs(folder_path, exist_ok=True)
+            
+            original_filename, unique_filename = build_upload_filename(
+                current_user, upload_session.filename, upload_session.course_id, upload_session.course_title
+            )
+            stored_path = os.path.join(folder_path, unique_filename)
+            shutil.move(temp_path, stored_path)
+            file_url = f"/uploads/{upload_session.folder}/{unique_filename}"
+            blob_hash = None
         
-        # Log the activity
-        log_activity = ActivityLog(
-            user_id=current_user.id,
-            action_type='file_upload',
-            details=f"User uploaded file: {original_filename}"
-        )
-        db.session.add(log_activity)
-        db.session.commit()
+        record_upload(current_user, course, original_filename, upload_session.file_type, file_url, size, blob_hash,
+                      upload_session=upload_session)
+        # The chunks are only dropped once the upload is recorded, so a failed completion can be retried
+        shutil.rmtree(upload_session.staging_path, ignore_errors=True)
         
         return jsonify({
             'message': 'File uploaded successfully',
             'fileUrl': file_url,
             'originalName': original_filename,
-            'type': file_type
+            'type': upload_session.file_type,
+            'sha256': checksum
         }), 201
-        
+    
     except Exception as e:
-        logger.error(f"Error uploading file: {str(e)}")
-        return jsonify({'message': f'Error uploading file: {str(e)}'}), 500
+        db.session.rollback()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        # Reloaded after the rollback: only reopen the session if its completion wasn't committed
+        if upload_session.status != 'complete':
+            # A stored blob may be shared with other resources; gc-blobs removes it if unreferenced
+            if stored_path and os.path.exists(stored_path):
+                os.remove(stored_path)
+            upload_session.status = 'open'
+            db.session.commit()
+        logger.error(f"Error completing upload session {session_id}: {str(e)}")
+        return jsonify({'message': f'Error completing upload: {str(e)}'}), 500
+
+@api.route('/api/uploads/sessions/<session_id>', methods=['DELETE'])
+@token_required
+def abort_upload_session(current_user, session_id):
+    upload_session = get_upload_session(current_user, session_id)
+    if not upload_session:
+        return jsonify({'message': 'Upload session not found'}), 404
+    if upload_session.status != 'open':
+        return jsonify({'message': f'Upload session is {upload_session.status}'}), 409
+    
+    shutil.rmtree(upload_session.staging_path, ignore_errors=True)
+    db.session.delete(upload_session)
+    db.session.commit()
+    
+    return jsonify({'message': 'Upload session aborted'}), 200
+
+def expire_upload_sessions(now=None):
+    """Delete open sessions with no chunk received for UPLOAD_SESSION_EXPIRY_HOURS. Returns (sessions, freed bytes)."""
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(hours=current_app.config['UPLOAD_SESSION_EXPIRY_HOURS'])
+    expired = 0
+    freed = 0
+    for upload_session in UploadSession.query.filter(UploadSession.status == 'open',
+                                                     UploadSession.created_at < cutoff).all():
+        staging_path = upload_session.staging_path
+        entries = [os.path.join(staging_path, name) for name in os.listdir(staging_path)] if os.path.isdir(staging_path) else []
+        # A session still receiving chunks is kept however old it is
+        if entries and datetime.utcfromtimestamp(max(os.path.getmtime(path) for path in entries)) >= cutoff:
+            continue
+        # Skip sessions a completion has claimed since they were listed
+        deleted = db.session.execute(db.delete(UploadSession).where(
+            UploadSession.id == upload_session.id, UploadSession.status == 'open')).rowcount
+        db.session.commit()
+        if deleted:
+            freed += sum(os.path.getsize(path) for path in entries if os.path.exists(path))
+            shutil.rmtree(staging_path, ignore_errors=True)
+            expired += 1
+    return expired, freed
+
+@api.cli.command('expire-upload-sessions')
+def expire_upload_sessions_command():
+    """Remove abandoned chunked upload sessions and their staged chunks."""
+    expired, freed = expire_upload_sessions()
+    print(f"Expired {expired} upload sessions ({freed} bytes)")
+
+# Media processing. The media worker claims pending MediaJob rows, runs
+# process_media_file() in a process pool (it only touches files, never the
+# database) and writes the results back to the CourseResource.
+def upload_url_to_path(url):
+    if not url or not url.startswith('/uploads/'):
+        return None
+    return stored_upload_path(url[len('/uploads/'):])
+
+def stored_upload_path(relative_url):
+    """Path of the file behind an /uploads/ URL path, or None if it escapes UPLOAD_FOLDER."""
+    path = safe_join(current_app.config['UPLOAD_FOLDER'], relative_url)
+    if path is not None and relative_url.startswith('blobs/'):
+        # Blob URLs carry the upload's extension, the blob file doesn't (older blobs still do)
+        blob_path = os.path.splitext(path)[0]
+        if os.path.isfile(blob_path):
+            return blob_path
+    return path
+
+def count_pdf_pages(path):
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(path).pages)
+    except ImportError:
+        # Without pypdf, count page objects in the raw file
+        with open(path, 'rb') as pdf_file:
+            return len(re.findall(rb'/Type\s*/Page(?!s)', pdf_file.read())) or None
+
+def process_media_file(path, file_type, derivative_dir, derivative_url, base_name, extension, max_image_pixels):
+    """Compute metadata and derivatives for one file. Runs in a worker process."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as media_file:
+        while True:
+            block = media_file.read(STREAM_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    result = {'checksum': digest.hexdigest(), 'derivatives': {}}
+    os.makedirs(derivative_dir, exist_ok=True)
+    
+    if file_type == 'image' or extension in ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'):
+        from PIL import Image
+        # Pillow only warns up to twice its limit; opening reads the header, not the pixels
+        Image.MAX_IMAGE_PIXELS = max_image_pixels
+        with Image.open(path) as image:
+            result['width'], result['height'] = image.size
+            if result['width'] * result['height'] > max_image_pixels:
+                raise ValueError(f"Image is {result['width']}x{result['height']}, "
+                                 f"more than {max_image_pixels} pixels")
+            image = image.convert('RGB')
+            for width in MEDIA_IMAGE_WIDTHS:
+                if width >= result['width'] and width != MEDIA_IMAGE_WIDTHS[0]:
+                    break
+                name = f'{base_name}_w{width}.webp'
+                target = os.path.join(derivative_dir, name)
+                if not os.path.exists(target):
+                    variant = image.copy()
+                    variant.thumbnail((width, width * 4))
+                    variant.save(target, 'WEBP', quality=80)
+                result['derivatives'][f'webp_{width}'] = f'{derivative_url}/{name}'
+            result['derivatives']['thumbnail'] = result['derivatives'][f'webp_{MEDIA_IMAGE_WIDTHS[0]}']
+    
+    elif file_type == 'pdf' or extension == '.pdf':
+        result['page_count'] = count_pdf_pages(path)
+    
+    elif file_type == 'video' or extension in ('.mp4', '.webm', '.mov', '.mkv', '.avi'):
+        # Poster frames need ffmpeg; without it videos only get a checksum
+        if shutil.which('ffmpeg'):
+            name = f'{base_name}_poster.jpg'
+            target = os.path.join(derivative_dir, name)
+            if not os.path.exists(target):
+                subprocess.run(
+                    ['ffmpeg', '-loglevel', 'error', '-y', '-ss', '1', '-i', path, '-frames:v', '1',
+                     '-vf', f'scale={MEDIA_IMAGE_WIDTHS[1]}:-2', target],
+                    check=True, timeout=120
+                )
+            result['derivatives']['poster'] = f'{derivative_url}/{name}'
+    
+    return result
+
+def claim_media_jobs(limit):
+    # Requeue jobs whose worker died mid-way
+    stale_before = datetime.utcnow() - timedelta(seconds=current_app.config['MEDIA_JOB_STALE_SECONDS'])
+    db.session.execute(
+        db.update(MediaJob)
+        .where(MediaJob.status == 'running', MediaJob.started_at < stale_before)
+        .values(status='pending')
+    )
+    db.session.commit()
+    
+    claimed = []
+    candidates = MediaJob.query.filter_by(status='pending').order_by(MediaJob.id).limit(limit).all()
+    for job in candidates:
+        # Conditional update so concurrent workers never run the same job
+        result = db.session.execute(
+            db.update(MediaJob)
+            .where(MediaJob.id == job.id, MediaJob.status == 'pending')
+            .values(status='running', started_at=datetime.utcnow(), attempts=MediaJob.attempts + 1)
+        )
+        if result.rowcount:
+            claimed.append(job.id)
+    db.session.commit()
+    return claimed
+
+def media_job_arguments(resource):
+    path = upload_url_to_path(resource.url)
+    if path is None or not os.path.isfile(path):
+        raise FileNotFoundError(f'No stored file for {resource.url}')
+    base_name = resource.blob_hash or os.path.splitext(os.path.basename(path))[0]
+    prefix = base_name[:2]
+    # Blob files have no extension; the resource URL keeps the uploaded one
+    return (path, resource.type, os.path.join(upload_subfolder(DERIVATIVES_SUBFOLDER), prefix),
+            f'/uploads/derivatives/{prefix}', base_name, os.path.splitext(resource.url)[1].lower(),
+            current_app.config['MEDIA_MAX_IMAGE_PIXELS'])
+
+def finish_media_job(job_id, result=None, error=None):
+    job = db.session.get(MediaJob, job_id)
+    if job is None:
+        return
+    resource = db.session.get(CourseResource, job.resource_id)
+    job.finished_at = datetime.utcnow()
+    
+    if error is None and resource is not None:
+        job.status = 'done'
+        job.error = None
+        resource.processing_status = 'done'
+        resource.checksum = result['checksum']
+        resource.width = result.get('width')
+        resource.height = result.get('height')
+        resource.page_count = result.get('page_count')
+        resource.derivatives = result['derivatives']
+    elif job.attempts < current_app.config['MEDIA_JOB_MAX_ATTEMPTS'] and resource is not None:
+        job.status = 'pending'
+        job.error = error
+    else:
+        job.status = 'failed'
+        job.error = error or 'Resource no longer exists'
+        if resource is not None:
+            resource.processing_status = 'failed'
+    db.session.commit()
+    if job.status == 'done':
+        catalog_cache.bump()
+
+class MediaWorkerPool:
+    """Process pool for media jobs that is replaced when one of its processes dies."""
+    def __init__(self, processes):
+        self.processes = processes
+        self.executor = ProcessPoolExecutor(max_workers=processes)
+        self.restarts = 0
+    
+    def submit(self, *args):
+        return self.executor.submit(process_media_file, *args)
+    
+    def restart(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = ProcessPoolExecutor(max_workers=self.processes)
+        self.restarts += 1
+    
+    def shutdown(self):
+        self.executor.shutdown()
+
+def run_media_job_alone(job_id, arguments):
+    # A fresh single-process pool, so a crash can only be this job's file
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        try:
+            finish_media_job(job_id, result=executor.submit(process_media_file, *arguments).result())
+        except BrokenProcessPool:
+            logger.error(f"Media job {job_id} failed: its worker process died")
+            finish_media_job(job_id, error='Worker process died while processing the file')
+        except Exception as e:
+            logger.error(f"Media job {job_id} failed: {str(e)}")
+            finish_media_job(job_id, error=str(e))
+
+def run_media_jobs(pool, limit):
+    """Process one batch of jobs on a MediaWorkerPool. Returns the number of jobs claimed."""
+    job_ids = claim_media_jobs(limit)
+    futures = {}
+    arguments = {}
+    # When a process dies (e.g. killed for memory on a hostile file) every job
+    # still in the pool fails with it. Those jobs are rerun one at a time under
+    # the same claim, so only the file that kills its process uses up an attempt.
+    interrupted = []
+    for job_id in job_ids:
+        job = db.session.get(MediaJob, job_id)
+        resource = db.session.get(CourseResource, job.resource_id)
+        try:
+            if resource is None:
+                raise LookupError('Resource no longer exists')
+            arguments[job_id] = media_job_arguments(resource)
+        except Exception as e:
+            finish_media_job(job_id, error=str(e))
+            continue
+        try:
+            futures[pool.submit(*arguments[job_id])] = job_id
+        except BrokenProcessPool:
+            interrupted.append(job_id)
+    
+    for future in as_completed(futures):
+        job_id = futures[future]
+        try:
+            finish_media_job(job_id, result=future.result())
+        except BrokenProcessPool:
+            interrupted.append(job_id)
+        except Exception as e:
+            logger.error(f"Media job {job_id} failed: {str(e)}")
+            finish_media_job(job_id, error=str(e))
+    
+    if interrupted:
+        logger.warning(f"Media worker process died; restarting the pool and rerunning {len(interrupted)} jobs one at a time")
+        pool.restart()
+        for job_id in sorted(interrupted):
+            run_media_job_alone(job_id, arguments[job_id])
+    return len(job_ids)
 
-# Serve uploaded files
-@app.route('/uploads/<path:folder>/<filename>')
+@api.cli.command('media-worker')
+@click.option('--processes', default=os.cpu_count() or 1, show_default=True, help='Worker processes.')
+@click.option('--poll-interval', default=2.0, show_default=True, help='Seconds to wait when the queue is empty.')
+@click.option('--once', is_flag=True, help='Exit when the queue is empty instead of polling.')
+def media_worker_command(processes, poll_interval, once):
+    """Generate thumbnails, WebP variants and metadata for uploaded resources."""
+    pool = MediaWorkerPool(processes)
+    try:
+        while True:
+            if run_media_jobs(pool, limit=processes * 2):
+                continue
+            if once:
+                break
+            time.sleep(poll_interval)
+    finally:
+        pool.shutdown()
+
+# Serve uploaded files (Range requests, ETag and Last-Modified are handled by send_file)
+@api.route('/uploads/<path:folder>/<filename>')
 def serve_file(folder, filename):
-    return send_from_directory(os.path.join(app.config['UPLOAD_FOLDER'], folder), filename)
+    file_path = stored_upload_path(f'{folder}/{filename}')
+    if file_path is None or not os.path.isfile(file_path):
+        return jsonify({'message': 'File not found'}), 404
+    # The URL's extension, not the stored file's name, decides the type (blobs are stored without one)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    
+    immutable = bool(IMMUTABLE_UPLOAD_NAME.search(filename))
+    max_age = IMMUTABLE_MEDIA_MAX_AGE if immutable else current_app.config['MEDIA_MAX_AGE']
+    offload = current_app.config['MEDIA_OFFLOAD']
+    
+    if offload in ('x-accel-redirect', 'x-sendfile'):
+        # Let the front proxy stream the bytes (and answer Range requests) so the worker is freed immediately
+        response = current_app.response_class(mimetype=mimetype)
+        if offload == 'x-accel-redirect':
+            stored_name = os.path.relpath(file_path, current_app.config['UPLOAD_FOLDER']).replace(os.sep, '/')
+            response.headers['X-Accel-Redirect'] = quote(f"{current_app.config['MEDIA_ACCEL_PREFIX']}/{stored_name}")
+        else:
+            response.headers['X-Sendfile'] = file_path
+    else:
+        response = send_file(file_path, mimetype=mimetype, max_age=max_age, conditional=True)
+        # Advertise seeking support on full responses too, not just on 206s
+        response.headers['Accept-Ranges'] = 'bytes'
+    
+    response.headers['Cache-Control'] = f"public, max-age={max_age}" + (', immutable' if immutable else '')
+    return response
 
 # Routes for courses
-@app.route('/api/courses', methods=['GET'])
+@api.route('/api/courses', methods=['GET'])
+@catalog_cached
+@read_replica
 def get_all_courses():
-    courses = Course.query.all()
-    return jsonify([course.to_dict() for course in courses]), 200
+    if not is_paginated_request():
+        courses = course_list_query().all()
+        return api_response([course.to_dict() for course in courses]), 200
+    
+    try:
+        fields = parse_fields(Course.API_FIELDS)
+        query = Course.query
+        if fields is None or 'resources' in fields:
+            query = query.options(selectinload(Course.resources))
+        if fields is not None and 'description' not in fields:
+            query = query.options(defer(Course.description))
+        courses, next_cursor = paginate_keyset(query, Course.id, COURSE_SORT_KEYS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    return api_response(paginated_response([course.to_dict(fields) for course in courses], next_cursor)), 200
 
-@app.route('/api/courses/<course_id>', methods=['GET'])
+@api.route('/api/courses/<course_id>', methods=['GET'])
 def get_course(course_id):
     # ... keep existing code (get_course function)
     course = Course.query.get(course_id)
     if not course:
         return jsonify({'message': 'Course not found'}), 404
     
-    # Increment view count
-    course.view_count += 1
-    db.session.commit()
+    # Increment view count (buffered and flushed in the background). Read the
+    # pending views first: with VIEW_COUNT_FLUSH_INTERVAL=0 increment() writes them out.
+    pending_views = view_counter.pending_for(course.id) + 1
+    view_counter.increment(course.id)
     
     # Log the activity if user is logged in
     if 'Authorization' in request.headers:
@@ -471,50 +2826,105 @@ def get_course(course_id):
             auth_header = request.headers['Authorization']
             if auth_header.startswith('Bearer '):
                 token = auth_header[7:]
-                data = jwt.decode(token, app.secret_key, algorithms=["HS256"])
-                current_user = User.query.get(data['user_id'])
+                data = auth_cache.decode_token(token)
+                current_user = auth_cache.load_user(data['user_id'])
                 
-                log_activity = ActivityLog(
+                activity_sink.log(
                     user_id=current_user.id,
                     action_type='course_view',
-                    details=f"User viewed course: {course.title}"
+                    details=f"User viewed course: {course.title}",
+                    course_id=course.id
                 )
-                db.session.add(log_activity)
-                db.session.commit()
         except:
             pass  # Silently ignore if token is invalid
     
-    return jsonify(course.to_dict()), 200
+    course_data = course.to_dict()
+    course_data['viewCount'] = (course.view_count or 0) + pending_views
+    return jsonify(course_data), 200
 
-@app.route('/api/courses/category/<category>', methods=['GET'])
+@api.route('/api/courses/category/<category>', methods=['GET'])
+@catalog_cached
+@read_replica
 def get_courses_by_category(category):
-    courses = Course.query.filter_by(category=category).all()
-    return jsonify([course.to_dict() for course in courses]), 200
+    courses = course_list_query().filter_by(category=category).all()
+    return api_response([course.to_dict() for course in courses]), 200
 
-@app.route('/api/courses/search', methods=['GET'])
+@api.route('/api/courses/trending', methods=['GET'])
+def get_trending_courses():
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'message': 'limit must be an integer'}), 400
+    limit = max(1, min(limit, current_app.config['TRENDING_TOP_K']))
+    return api_response(trending_index.top(limit))
+
+@api.route('/api/courses/search', methods=['GET'])
+@read_replica
 def search_courses():
     # ... keep existing code (search_courses function)
     query = request.args.get('q', '')
-    if not query:
-        return jsonify([]), 200
-    
-    courses = Course.query.filter(
-        db.or_(
-            Course.title.ilike(f'%{query}%'),
-            Course.category.ilike(f'%{query}%'),
-            Course.author.ilike(f'%{query}%')
-        )
-    ).all()
+    paginated = is_paginated_request()
+    terms = re.findall(r'\w+', query.lower())
+    
+    fields = None
+    limit = None
+    offset = 0
+    if paginated:
+        try:
+            fields = parse_fields(Course.API_FIELDS)
+            limit = parse_page_limit()
+            if request.args.get('cursor'):
+                offset = decode_offset_cursor(request.args['cursor'])
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+    
+    if not terms:
+        return api_response(paginated_response([], None) if paginated else []), 200
+    
+    # Fetch one extra id to learn whether another page exists
+    course_ids = search_course_ids(terms, limit + 1 if limit else None, offset)
+    next_cursor = None
+    if limit and len(course_ids) > limit:
+        course_ids = course_ids[:limit]
+        next_cursor = encode_offset_cursor(offset + limit)
+    
+    courses_by_id = {}
+    if course_ids:
+        courses_by_id = {course.id: course for course in course_list_query().filter(Course.id.in_(course_ids))}
+    courses = [courses_by_id[course_id] for course_id in course_ids if course_id in courses_by_id]
     
-    return jsonify([course.to_dict() for course in courses]), 200
+    if not paginated:
+        return api_response([course.to_dict() for course in courses]), 200
+    return api_response(paginated_response([course.to_dict(fields) for course in courses], next_cursor)), 200
+
+@api.route('/api/courses/<int:course_id>/related', methods=['GET'])
+@catalog_cached
+@read_replica
+def get_related_courses(course_id):
+    rows = db.session.query(Course, RelatedCourse.score, RelatedCourse.source) \
+        .join(Course, Course.id == RelatedCourse.related_id) \
+        .filter(RelatedCourse.course_id == course_id) \
+        .order_by(RelatedCourse.rank)
+    related = []
+    for course, score, source in rows:
+        entry = course.to_dict(TRENDING_FIELDS)
+        entry['relatedScore'] = round(score, 3)
+        entry['relatedBy'] = source
+        related.append(entry)
+    # Courses the job hasn't seen yet have no rows; only then check the course exists
+    if not related and db.session.get(Course, course_id) is None:
+        return jsonify({'message': 'Course not found'}), 404
+    return api_response(related), 200
 
 # Add course resources endpoint
-@app.route('/api/courses/<course_id>/resources', methods=['GET'])
+@api.route('/api/courses/<course_id>/resources', methods=['GET'])
+@catalog_cached
+@read_replica
 def get_course_resources(course_id):
     resources = CourseResource.query.filter_by(course_id=course_id).all()
-    return jsonify([resource.to_dict() for resource in resources]), 200
+    return api_response([resource.to_dict() for resource in resources]), 200
 
-@app.route('/api/courses/<course_id>/resources', methods=['POST'])
+@api.route('/api/courses/<course_id>/resources', methods=['POST'])
 @token_required
 def add_course_resource(current_user, course_id):
     # ... keep existing code (add_course_resource function)
@@ -540,23 +2950,23 @@ def add_course_resource(current_user, course_id):
     
     db.session.add(resource)
     db.session.commit()
+    catalog_cache.bump()
     
     return jsonify(resource.to_dict()), 201
 
 # Admin-only routes
-@app.route('/api/admin/courses', methods=['POST'])
+@api.route('/api/admin/courses', methods=['POST'])
 @token_required
 def add_course(current_user):
     # ... keep existing code (add_course function)
-    # Log everything for debugging
-    logger.debug(f"Add course request from user {current_user.id} with role {current_user.role}")
-    logger.debug(f"Request data: {request.get_json()}")
+    logger.debug("Add course request from user %s with role %s", current_user.id, current_user.role)
 
     if current_user.role != 'admin' and current_user.role != 'teacher':
-        logger.debug(f"Unauthorized: user role is {current_user.role}")
+        logger.debug("Unauthorized: user role is %s", current_user.role)
         return jsonify({'message': 'Admin or teacher access required'}), 403
     
     data = request.get_json()
+    logger.debug("Request data: %s", data)
     
     # Validate input data
     if not data:
@@ -581,25 +2991,28 @@ def add_course(current_user):
             duration=data.get('duration', ''),
             price=data.get('price', ''),
             category=data.get('category', ''),
-            view_count=data.get('viewCount', 0),
-            enrollment_count=data.get('enrollmentCount', 0),
-            popularity_score=data.get('popularityScore', 0)
+            view_count=data.get('viewCount') or 0,
+            enrollment_count=data.get('enrollmentCount') or 0,
+            popularity_score=data.get('popularityScore') or 0
         )
         
         db.session.add(new_course)
+        db.session.flush()
+        index_course(new_course)
+        bump_stats(course_stat_deltas(new_course))
         db.session.commit()
+        catalog_cache.bump()
         
         # Log the activity
         action_type = 'course_create_teacher' if current_user.role == 'teacher' else 'course_create_admin'
-        log_activity = ActivityLog(
+        activity_sink.log(
             user_id=current_user.id,
             action_type=action_type,
-            details=f"{current_user.role.capitalize()} created course: {new_course.title}"
+            details=f"{current_user.role.capitalize()} created course: {new_course.title}",
+            course_id=new_course.id
         )
-        db.session.add(log_activity)
-        db.session.commit()
         
-        logger.debug(f"Course created successfully: {new_course.to_dict()}")
+        logger.debug("Course created successfully: %s", new_course.id)
         return jsonify(new_course.to_dict()), 201
     
     except Exception as e:
@@ -607,7 +3020,7 @@ def add_course(current_user):
         logger.error(f"Error creating course: {str(e)}")
         return jsonify({'message': f'Error creating course: {str(e)}'}), 500
 
-@app.route('/api/admin/courses/<course_id>', methods=['PUT'])
+@api.route('/api/admin/courses/<course_id>', methods=['PUT'])
 @token_required
 def update_course(current_user, course_id):
     # ... keep existing code (update_course function)
@@ -619,6 +3032,7 @@ def update_course(current_user, course_id):
         return jsonify({'message': 'Course not found'}), 404
     
     data = request.get_json()
+    previous_category = course.category
     
     # Update course fields
     if 'title' in data:
@@ -638,21 +3052,24 @@ def update_course(current_user, course_id):
     if 'category' in data:
         course.category = data['category']
     
+    if course.category != previous_category:
+        bump_stats({f"category:{previous_category or ''}": -1, f"category:{course.category or ''}": 1})
+    index_course(course)
     db.session.commit()
+    catalog_cache.bump()
     
     # Log the activity
     action_type = 'course_update_teacher' if current_user.role == 'teacher' else 'course_update_admin'
-    log_activity = ActivityLog(
+    activity_sink.log(
         user_id=current_user.id,
         action_type=action_type,
-        details=f"{current_user.role.capitalize()} updated course: {course.title}"
+        details=f"{current_user.role.capitalize()} updated course: {course.title}",
+        course_id=course.id
     )
-    db.session.add(log_activity)
-    db.session.commit()
     
     return jsonify(course.to_dict()), 200
 
-@app.route('/api/admin/courses/<course_id>', methods=['DELETE'])
+@api.route('/api/admin/courses/<course_id>', methods=['DELETE'])
 @token_required
 def delete_course(current_user, course_id):
     # ... keep existing code (delete_course function)
@@ -664,72 +3081,70 @@ def delete_course(current_user, course_id):
         return jsonify({'message': 'Course not found'}), 404
     
     course_title = course.title
+    deleted_course_id = course.id
+    unindex_course(course.id)
+    bump_stats(course_stat_deltas(course, sign=-1))
     db.session.delete(course)
     db.session.commit()
+    catalog_cache.bump()
     
     # Log the activity
     action_type = 'course_delete_teacher' if current_user.role == 'teacher' else 'course_delete_admin'
-    log_activity = ActivityLog(
+    activity_sink.log(
         user_id=current_user.id,
         action_type=action_type,
-        details=f"{current_user.role.capitalize()} deleted course: {course_title}"
+        details=f"{current_user.role.capitalize()} deleted course: {course_title}",
+        course_id=deleted_course_id
     )
-    db.session.add(log_activity)
-    db.session.commit()
     
     return jsonify({'message': 'Course deleted successfully'}), 200
 
 # Admin dashboard data endpoints
-@app.route('/api/admin/dashboard', methods=['GET'])
+@api.route('/api/admin/dashboard', methods=['GET'])
 @token_required
+@read_replica
 def get_admin_dashboard(current_user):
     # ... keep existing code (get_admin_dashboard function)
     if current_user.role != 'admin':
         return jsonify({'message': 'Admin access required'}), 403
     
-    # Get total users
-    total_users = User.query.count()
-    
-    # Get new users today
-    today = datetime.today().date()
-    new_users_today = User.query.filter(
-        db.func.date(User.created_at) == today
-    ).count()
-    
-    # Get today's logins
-    today_logins = User.query.filter(
-        db.func.date(User.last_login) == today
-    ).count()
-    
-    # Get total courses
-    total_courses = Course.query.count()
-    
-    # Get courses by category
-    categories = db.session.query(Course.category, db.func.count(Course.id)).group_by(Course.category).all()
-    categories_data = [{'name': cat, 'count': count} for cat, count in categories]
-    
-    # Get total enrollments
-    total_enrollments = db.session.query(db.func.sum(Course.enrollment_count)).scalar() or 0
+    # Read the maintained counters in one query
+    today = datetime.utcnow().date().isoformat()
+    stats = dict(db.session.query(DashboardStat.key, DashboardStat.value).filter(db.or_(
+        DashboardStat.key.in_(['total_users', 'total_courses', 'total_enrollments',
+                               f"new_users:{today}", f"logins:{today}"]),
+        # Range instead of LIKE so the primary key index serves it (';' sorts right after ':')
+        db.and_(DashboardStat.key >= 'category:', DashboardStat.key < 'category;')
+    )))
+    total_users = stats.get('total_users', 0)
+    new_users_today = stats.get(f"new_users:{today}", 0)
+    today_logins = stats.get(f"logins:{today}", 0)
+    total_courses = stats.get('total_courses', 0)
+    total_enrollments = stats.get('total_enrollments', 0)
+    categories_data = [
+        {'name': key[len('category:'):], 'count': value}
+        for key, value in sorted(stats.items()) if key.startswith('category:') and value > 0
+    ]
     
     # Get most viewed courses
-    most_viewed_courses = Course.query.order_by(Course.view_count.desc()).limit(5).all()
+    most_viewed_courses = course_list_query().order_by(Course.view_count.desc()).limit(5).all()
     
-    # Get recent activities
-    recent_activities = ActivityLog.query.order_by(ActivityLog.created_at.desc()).limit(10).all()
-    
-    # Format activities with user information
-    activities_with_user = []
-    for activity in recent_activities:
-        user = User.query.get(activity.user_id)
-        if user:
-            activities_with_user.append({
-                'id': activity.id,
-                'username': user.username,
-                'email': user.email,
-                'action_type': activity.action_type,
-                'details': activity.details,
-                'created_at': activity.created_at.isoformat()
-            })
+    # Get recent activities together with their users
+    recent_activities = (
+        db.session.query(ActivityLog, User.username, User.email)
+        .join(User, ActivityLog.user_id == User.id)
+        .order_by(ActivityLog.created_at.desc())
+        .limit(10)
+        .all()
+    )
+    activities_with_user = [{
+        'id': activity.id,
+        'username': username,
+        'email': email,
+        'action_type': activity.action_type,
+        'details': activity.details,
+        'created_at': activity.created_at.isoformat()
+    } for activity, username, email in recent_activities]
     
     return jsonify({
         'stats': {
@@ -745,17 +3160,227 @@ def get_admin_dashboard(current_user):
         'recent_activities': activities_with_user
     }), 200
 
-@app.route('/api/admin/users', methods=['GET'])
+@api.route('/api/admin/users', methods=['GET'])
 @token_required
+@read_replica
 def get_all_users(current_user):
     if current_user.role != 'admin':
         return jsonify({'message': 'Admin access required'}), 403
     
-    users = User.query.all()
-    return jsonify([user.to_dict() for user in users]), 200
+    if not is_paginated_request():
+        users = User.query.all()
+        return api_response([user.to_dict() for user in users]), 200
+    
+    try:
+        fields = parse_fields(User.API_FIELDS)
+        users, next_cursor = paginate_keyset(User.query, User.id, USER_SORT_KEYS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    return api_response(paginated_response([user.to_dict(fields) for user in users], next_cursor)), 200
+
+@api.route('/api/admin/view-counts/stats', methods=['GET'])
+@token_required
+def get_view_count_stats(current_user):
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    
+    return jsonify(view_counter.stats()), 200
+
+@api.route('/api/admin/activity/rollups', methods=['GET'])
+@token_required
+@read_replica
+def get_activity_rollups(current_user):
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    
+    query = ActivityRollup.query
+    try:
+        if request.args.get('from'):
+            query = query.filter(ActivityRollup.day >= datetime.strptime(request.args['from'], '%Y-%m-%d').date())
+        if request.args.get('to'):
+            query = query.filter(ActivityRollup.day <= datetime.strptime(request.args['to'], '%Y-%m-%d').date())
+    except ValueError:
+        return jsonify({'message': 'from and to must be dates in YYYY-MM-DD format'}), 400
+    if request.args.get('action_type'):
+        query = query.filter(ActivityRollup.action_type == request.args['action_type'])
+    if request.args.get('course_id', '').isdigit():
+        query = query.filter(ActivityRollup.course_id == int(request.args['course_id']))
+    
+    rollups = query.order_by(ActivityRollup.day, ActivityRollup.action_type, ActivityRollup.course_id).all()
+    return api_response([rollup.to_dict() for rollup in rollups]), 200
+
+# Streaming data exports. Rows are read with yield_per (a server-side cursor
+# on Postgres) and written to the response body by a generator one batch at
+# a time, so a worker's memory stays flat however many rows are exported.
+# compress_response leaves streamed bodies alone, so exports gzip their own
+# output on the fly for clients that accept it.
+EXPORT_BATCH_SIZE = 1000
+EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+COURSE_EXPORT_FIELDS = tuple(field for field in Course.API_FIELDS if field != 'resources')
+ACTIVITY_EXPORT_FIELDS = ('id', 'user_id', 'action_type', 'details', 'course_id', 'created_at')
+
+def export_date_filters(column):
+    """Filters for ?from=&to= (inclusive, YYYY-MM-DD) on column. Raises ValueError on bad dates."""
+    filters = []
+    if request.args.get('from'):
+        filters.append(column >= datetime.strptime(request.args['from'], '%Y-%m-%d'))
+    if request.args.get('to'):
+        filters.append(column < datetime.strptime(request.args['to'], '%Y-%m-%d') + timedelta(days=1))
+    return filters
+
+def csv_cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return current_app.json.dumps(value)
+    return value
+
+def generate_export(query, fields, serialize, export_format, compress):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if export_format == 'csv' else None
+    compressor = zlib.compressobj(current_app.config['COMPRESSION_GZIP_LEVEL'], zlib.DEFLATED, 31) if compress else None
+    
+    def take_chunk():
+        chunk = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(chunk) if compressor else chunk
+    
+    if writer is not None:
+        writer.writerow(fields)
+    for count, row in enumerate(query.yield_per(EXPORT_BATCH_SIZE), 1):
+        data = serialize(row)
+        if writer is not None:
+            writer.writerow([csv_cell(data[field]) for field in fields])
+        else:
+            buffer.write(current_app.json.dumps(data))
+            buffer.write('\n')
+        if count % EXPORT_BATCH_SIZE == 0:
+            chunk = take_chunk()
+            if chunk:
+                yield chunk
+    
+    chunk = take_chunk()
+    if compressor:
+        chunk += compressor.flush()
+    yield chunk
+
+def export_response(name, query, fields, serialize):
+    """Stream the query's rows as NDJSON or, with ?format=csv, as CSV with a header row."""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_MIMETYPES:
+        return jsonify({'message': 'format must be ndjson or csv'}), 400
+    
+    compress = current_app.config['COMPRESSION_ENABLED'] and request.accept_encodings.best_match(['gzip']) == 'gzip'
+    # stream_with_context keeps the request (and its database session) open while the body is sent
+    response = current_app.response_class(
+        stream_with_context(generate_export(query, fields, serialize, export_format, compress)),
+        mimetype=EXPORT_MIMETYPES[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename={name}.{export_format}'
+    response.vary.add('Accept-Encoding')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@api.route('/api/admin/export/users', methods=['GET'])
+@token_required
+@read_replica
+def export_users(current_user):
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    
+    try:
+        filters = export_date_filters(User.created_at)
+    except ValueError:
+        return jsonify({'message': 'from and to must be dates in YYYY-MM-DD format'}), 400
+    
+    query = User.query.filter(*filters).order_by(User.created_at, User.id)
+    return export_response('users', query, User.API_FIELDS, lambda user: user.to_dict())
+
+@api.route('/api/admin/export/courses', methods=['GET'])
+@token_required
+@read_replica
+def export_courses(current_user):
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    
+    try:
+        filters = export_date_filters(Course.created_at)
+    except ValueError:
+        return jsonify({'message': 'from and to must be dates in YYYY-MM-DD format'}), 400
+    
+    query = Course.query.filter(*filters).order_by(Course.created_at, Course.id)
+    return export_response('courses', query, COURSE_EXPORT_FIELDS, lambda course: course.to_dict(COURSE_EXPORT_FIELDS))
+
+@api.route('/api/admin/export/activity', methods=['GET'])
+@token_required
+@read_replica
+def export_activity(current_user):
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    
+    try:
+        filters = export_date_filters(ActivityLog.created_at)
+    except ValueError:
+        return jsonify({'message': 'from and to must be dates in YYYY-MM-DD format'}), 400
+    if request.args.get('action_type'):
+        filters.append(ActivityLog.action_type == request.args['action_type'])
+    if request.args.get('course_id', '').isdigit():
+        filters.append(ActivityLog.course_id == int(request.args['course_id']))
+    
+    query = ActivityLog.query.filter(*filters).order_by(ActivityLog.created_at, ActivityLog.id)
+    return export_response('activity', query, ACTIVITY_EXPORT_FIELDS, lambda entry: entry.to_dict())
+
+@api.route('/api/admin/activity-log/stats', methods=['GET'])
+@token_required
+def get_activity_log_stats(current_user):
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    
+    return jsonify(activity_sink.stats()), 200
+
+@api.route('/api/admin/password-hashing/stats', methods=['GET'])
+@token_required
+def get_password_hashing_stats(current_user):
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    
+    return jsonify(password_hasher.stats()), 200
+
+@api.route('/api/admin/read-replicas/stats', methods=['GET'])
+@token_required
+def get_read_replica_stats(current_user):
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    return jsonify(replica_router.stats()), 200
+
+@api.route('/api/admin/compression/stats', methods=['GET'])
+@token_required
+def get_compression_stats(current_user):
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    return jsonify(compression_cache.stats()), 200
+
+@api.route('/api/admin/auth-cache/stats', methods=['GET'])
+@token_required
+def get_auth_cache_stats(current_user):
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+    
+    return jsonify(auth_cache.stats()), 200
 
 # Add token verification endpoint
-@app.route('/api/auth/verify-token', methods=['GET'])
+@api.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'message': 'Metrics token required'}), 401
+    if not current_app.config['METRICS_ENABLED']:
+        return jsonify({'message': 'Metrics are disabled'}), 404
+    return current_app.response_class(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/api/auth/verify-token', methods=['GET'])
 @token_required
 def verify_token(current_user):
     return jsonify({
@@ -763,7 +3388,7 @@ def verify_token(current_user):
         'user': current_user.to_dict()
     }), 200
 
-@app.route('/api/ensure-data', methods=['GET'])
+@api.route('/api/ensure-data', methods=['GET'])
 def ensure_data():
     # ... keep existing code (ensure_data function)
     # Check if any courses exist
@@ -785,7 +3410,11 @@ def ensure_data():
         )
         
         db.session.add(sample_course)
+        db.session.flush()
+        index_course(sample_course)
+        bump_stats(course_stat_deltas(sample_course))
         db.session.commit()
+        catalog_cache.bump()
         
         return jsonify({
             'message': 'Created initial course data',
@@ -797,11 +3426,597 @@ def ensure_data():
         'course_count': course_count
     }), 200
 
-# Create database tables on startup
-with app.app_context():
-    db.create_all()
-    logger.info("Database tables created (if they didn't exist already)")
+# Activity log retention. Closed days are rolled up into ActivityRollup
+# incrementally (only days since the last rollup are recomputed, and never a
+# day whose raw rows may be archived already), and days
+# past the retention window are written to a gzip NDJSON archive and then
+# deleted. Each run handles at most max_days days so it finishes in bounded time.
+def day_bounds(day):
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+def rollup_activity_day(day):
+    start, end = day_bounds(day)
+    db.session.execute(db.delete(ActivityRollup).where(ActivityRollup.day == day))
+    counts = (
+        db.session.query(ActivityLog.action_type, db.func.coalesce(ActivityLog.course_id, 0), db.func.count(ActivityLog.id))
+        .filter(ActivityLog.created_at >= start, ActivityLog.created_at < end)
+        .group_by(ActivityLog.action_type, db.func.coalesce(ActivityLog.course_id, 0))
+        .all()
+    )
+    db.session.add_all([
+        ActivityRollup(day=day, action_type=action_type, course_id=course_id, count=count)
+        for action_type, course_id, count in counts
+    ])
+    db.session.commit()
+    return len(counts)
+
+def archive_cutoff():
+    """Days before this date are past the retention window and get archived."""
+    return datetime.utcnow().date() - timedelta(days=current_app.config['ACTIVITY_RETENTION_DAYS'])
+
+def rollup_activity(max_days):
+    """Roll up closed days not yet rolled up. Returns the days processed."""
+    today = datetime.utcnow().date()
+    last_rolled = db.session.query(db.func.max(ActivityRollup.day)).scalar()
+    if last_rolled is not None:
+        # Recompute the last rolled day once more to pick up events written after it
+        # closed, unless its raw rows may already be archived: recounting would lose them
+        day = last_rolled if last_rolled > archive_cutoff() else last_rolled + timedelta(days=1)
+    else:
+        first_event = db.session.query(db.func.min(ActivityLog.created_at)).scalar()
+        if first_event is None:
+            return []
+        day = first_event.date()
+    
+    processed = []
+    while day < today and len(processed) < max_days:
+        rollup_activity_day(day)
+        processed.append(day)
+        day += timedelta(days=1)
+    return processed
+
+def archive_activity_day(day):
+    """Write one day's raw rows to a gzip NDJSON file, then delete them. Returns the row count."""
+    start, end = day_bounds(day)
+    day_filter = db.and_(ActivityLog.created_at >= start, ActivityLog.created_at < end)
+    
+    folder = os.path.join(current_app.config['ACTIVITY_ARCHIVE_FOLDER'], f'{day:%Y}')
+    os.makedirs(folder, exist_ok=True)
+    # Late rows for an already archived day go to a numbered sibling file
+    path = os.path.join(folder, f'activity-{day.isoformat()}.ndjson.gz')
+    part = 1
+    while os.path.exists(path):
+        part += 1
+        path = os.path.join(folder, f'activity-{day.isoformat()}.{part}.ndjson.gz')
+    
+    temp_path = f'{path}.tmp'
+    count = 0
+    with gzip.open(temp_path, 'wt', encoding='utf-8') as archive:
+        for entry in ActivityLog.query.filter(day_filter).order_by(ActivityLog.id).yield_per(1000):
+            archive.write(json.dumps(entry.to_dict(), separators=(',', ':')) + '\n')
+            count += 1
+    
+    if count == 0:
+        os.remove(temp_path)
+        return 0
+    # The archive is complete on disk before any row is deleted
+    os.replace(temp_path, path)
+    db.session.execute(db.delete(ActivityLog).where(day_filter))
+    db.session.commit()
+    return count
+
+def archive_activity(max_days):
+    """Archive days older than the retention window. Returns {day: archived rows}."""
+    cutoff = archive_cutoff()
+    archived = {}
+    while len(archived) < max_days:
+        first_event = db.session.query(db.func.min(ActivityLog.created_at)).filter(
+            ActivityLog.created_at < datetime.combine(cutoff, datetime.min.time())).scalar()
+        if first_event is None:
+            break
+        day = first_event.date()
+        # Never drop raw rows that haven't been counted
+        if db.session.query(ActivityRollup.day).filter(ActivityRollup.day == day).first() is None:
+            rollup_activity_day(day)
+        archived[day] = archive_activity_day(day)
+    return archived
+
+@api.cli.command('activity-maintenance')
+@click.option('--max-days', default=31, show_default=True, help='Most days to roll up and to archive in this run.')
+def activity_maintenance_command(max_days):
+    """Roll up closed days of activity and archive rows past the retention window."""
+    rolled = rollup_activity(max_days)
+    print(f"Rolled up {len(rolled)} days" + (f" ({rolled[0]} to {rolled[-1]})" if rolled else ''))
+    archived = archive_activity(max_days)
+    for day, count in archived.items():
+        print(f"Archived {count} activity rows for {day}")
+    if not archived:
+        print(f"Nothing older than {current_app.config['ACTIVITY_RETENTION_DAYS']} days to archive")
+
+# Trending engine. Views are counted per course and hour in SQL, so the job
+# reads at most one row per course per hour of the window, and each hour's
+# decay weight is computed once. Enrollment gains are folded into a decayed
+# running total per course, since enrollment_count has no history.
+def hour_bucket(column):
+    if db.engine.dialect.name == 'postgresql':
+        return db.func.date_trunc('hour', column)
+    return db.func.strftime('%Y-%m-%d %H:00:00', column)
+
+def update_trending_scores(now=None):
+    """Recompute trending scores and write them to Course.popularity_score. Returns (courses, changed)."""
+    now = now or datetime.utcnow()
+    half_life = current_app.config['TRENDING_HALF_LIFE_HOURS'] * 3600
+    
+    def decay(since):
+        return 0.5 ** (max((now - since).total_seconds(), 0) / half_life)
+    
+    bucket = hour_bucket(ActivityLog.created_at)
+    view_counts = db.session.query(ActivityLog.course_id, bucket, db.func.count()).filter(
+        ActivityLog.action_type == 'course_view',
+        ActivityLog.course_id.isnot(None),
+        ActivityLog.created_at >= now - timedelta(days=current_app.config['TRENDING_WINDOW_DAYS'])
+    ).group_by(ActivityLog.course_id, bucket)
+    
+    weights = {}
+    view_scores = {}
+    for course_id, hour, count in view_counts:
+        if hour not in weights:
+            started = hour if isinstance(hour, datetime) else datetime.fromisoformat(hour)
+            weights[hour] = decay(started + timedelta(minutes=30))  # middle of the hour
+        view_scores[course_id] = view_scores.get(course_id, 0.0) + count * weights[hour]
+    
+    trends = {trend.course_id: trend for trend in CourseTrend.query}
+    new_trends, trend_updates, course_updates = [], [], []
+    for course_id, enrollment_count, popularity_score in db.session.execute(
+            db.select(Course.id, Course.enrollment_count, Course.popularity_score)):
+        enrollment_count = enrollment_count or 0
+        trend = trends.pop(course_id, None)
+        # A course's first run sets the baseline; only later gains count
+        enrollment_score = 0.0
+        if trend is not None:
+            enrollment_score = trend.enrollment_score * decay(trend.updated_at) \
+                + max(enrollment_count - trend.last_enrollment_count, 0)
+        score = view_scores.get(course_id, 0.0) + current_app.config['TRENDING_ENROLLMENT_WEIGHT'] * enrollment_score
+        
+        row = {
+            'course_id': course_id,
+            'score': score,
+            'enrollment_score': enrollment_score,
+            'last_enrollment_count': enrollment_count,
+            'updated_at': now
+        }
+        (new_trends if trend is None else trend_updates).append(row)
+        if round(score) != popularity_score:
+            course_updates.append({'id': course_id, 'popularity_score': round(score)})
+    
+    # Bulk statements: one executemany per table instead of a flush per object
+    db.session.expire_all()
+    if trends:
+        db.session.execute(db.delete(CourseTrend).where(CourseTrend.course_id.in_(list(trends))))
+    if trend_updates:
+        db.session.execute(db.update(CourseTrend), trend_updates)
+    if new_trends:
+        db.session.execute(db.insert(CourseTrend), new_trends)
+    if course_updates:
+        db.session.execute(db.update(Course), course_updates)
+    db.session.commit()
+    if course_updates:
+        catalog_cache.bump()
+    return len(trend_updates) + len(new_trends), len(course_updates)
+
+@api.cli.command('update-trending')
+def update_trending_command():
+    """Recompute time-decayed trending scores into Course.popularity_score."""
+    courses, changed = update_trending_scores()
+    print(f"Scored {courses} courses, {changed} popularity scores changed")
+
+# In-memory top-K of trending courses, serialized ahead of time so
+# /api/courses/trending is a list slice. Each worker process loads it on
+# first use and reloads it in a background thread.
+TRENDING_FIELDS = tuple(field for field in Course.API_FIELDS if field != 'resources')
+
+class TrendingIndex:
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.lock = threading.Lock()
+        self.entries = []
+        self.loaded_at = None
+        self.thread = None
+        self.thread_pid = None
+        self.stop_event = threading.Event()
+    
+    def top(self, limit):
+        self.ensure_started()
+        with self.lock:
+            return self.entries[:limit]
+    
+    def load(self):
+        with self.app.app_context():
+            rows = db.session.query(Course, CourseTrend.score) \
+                .join(CourseTrend, CourseTrend.course_id == Course.id) \
+                .filter(CourseTrend.score > 0) \
+                .order_by(CourseTrend.score.desc(), Course.id) \
+                .limit(self.app.config['TRENDING_TOP_K'])
+            entries = []
+            for course, score in rows:
+                entry = course.to_dict(TRENDING_FIELDS)
+                entry['trendingScore'] = round(score, 3)
+                entries.append(entry)
+        with self.lock:
+            self.entries = entries
+            self.loaded_at = datetime.utcnow()
+    
+    def ensure_started(self):
+        # Threads don't survive fork, so each worker process loads and refreshes its own copy
+        if self.thread is not None and self.thread_pid == os.getpid() and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is not None and self.thread_pid == os.getpid() and self.thread.is_alive():
+                return
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, name='trending-refresh', daemon=True)
+            self.thread_pid = os.getpid()
+            self.thread.start()
+        self.load()
+    
+    def run(self):
+        while not self.stop_event.wait(self.app.config['TRENDING_REFRESH_INTERVAL']):
+            try:
+                self.load()
+            except Exception as e:
+                logger.error(f"Error refreshing trending courses: {str(e)}")
+
+trending_index = app_service('trending_index')
+
+# Related courses. The job reads each user's distinct viewed courses in the
+# window (one row per user and course, ordered by user so only one user's
+# list is held at a time) and accumulates a sparse co-occurrence matrix as
+# nested dicts. Pairs are scored by cosine similarity, count(a, b) /
+# sqrt(viewers(a) * viewers(b)), so popular courses don't become everyone's
+# neighbour. Only courses whose neighbour lists changed are rewritten.
+def coview_matrix(since):
+    """Return ({course_id: {other_id: users who viewed both}}, {course_id: users who viewed it})."""
+    max_views = current_app.config['RELATED_MAX_VIEWS_PER_USER']
+    cooccurrences = {}
+    viewers = {}
+    
+    def add_user(course_ids):
+        course_ids = course_ids[:max_views]
+        for course_id in course_ids:
+            viewers[course_id] = viewers.get(course_id, 0) + 1
+        for i, course_id in enumerate(course_ids):
+            row = cooccurrences.setdefault(course_id, {})
+            for other_id in course_ids[i + 1:]:
+                row[other_id] = row.get(other_id, 0) + 1
+                other_row = cooccurrences.setdefault(other_id, {})
+                other_row[course_id] = other_row.get(course_id, 0) + 1
+    
+    last_viewed = db.func.max(ActivityLog.created_at)
+    views = db.session.query(ActivityLog.user_id, ActivityLog.course_id).filter(
+        ActivityLog.action_type == 'course_view',
+        ActivityLog.user_id.isnot(None),
+        ActivityLog.course_id.isnot(None),
+        ActivityLog.created_at >= since
+    ).group_by(ActivityLog.user_id, ActivityLog.course_id) \
+        .order_by(ActivityLog.user_id, last_viewed.desc()) \
+        .execution_options(yield_per=10000)
+    
+    current_user_id, course_ids = None, []
+    for user_id, course_id in views:
+        if user_id != current_user_id:
+            add_user(course_ids)
+            current_user_id, course_ids = user_id, []
+        course_ids.append(course_id)
+    add_user(course_ids)
+    return cooccurrences, viewers
+
+def update_related_courses(now=None):
+    """Recompute every course's related courses. Returns (courses, changed)."""
+    now = now or datetime.utcnow()
+    top_n = current_app.config['RELATED_TOP_N']
+    cooccurrences, viewers = coview_matrix(now - timedelta(days=current_app.config['RELATED_WINDOW_DAYS']))
+    
+    courses = db.session.execute(
+        db.select(Course.id, Course.category)
+        .order_by(Course.popularity_score.desc(), Course.rating.desc(), Course.id)).all()
+    by_category = {}
+    for course_id, category in courses:
+        members = by_category.setdefault(category, [])
+        if len(members) <= top_n:  # one spare in case the course itself is among them
+            members.append(course_id)
+    
+    existing = {}
+    for row in RelatedCourse.query.order_by(RelatedCourse.course_id, RelatedCourse.rank):
+        existing.setdefault(row.course_id, []).append((row.related_id, round(row.score, 6), row.source))
+    
+    course_ids = {course_id for course_id, _ in courses}
+    changed, new_rows = [], []
+    for course_id, category in courses:
+        scored = [
+            (count / (viewers[course_id] * viewers[other_id]) ** 0.5, other_id)
+            for other_id, count in cooccurrences.get(course_id, {}).items() if other_id in course_ids
+        ]
+        neighbours = [(other_id, round(score, 6), 'coview')
+                      for score, other_id in heapq.nlargest(top_n, scored, key=lambda item: (item[0], -item[1]))]
+        # Cold start: pad with the category's most popular courses
+        seen = {course_id} | {other_id for other_id, _, _ in neighbours}
+        for other_id in by_category.get(category, []):
+            if len(neighbours) >= top_n:
+                break
+            if other_id not in seen:
+                neighbours.append((other_id, 0.0, 'category'))
+        
+        if existing.pop(course_id, []) != neighbours:
+            changed.append(course_id)
+            new_rows.extend({'course_id': course_id, 'rank': rank, 'related_id': other_id,
+                             'score': score, 'source': source}
+                            for rank, (other_id, score, source) in enumerate(neighbours))
+    
+    # Rows left in existing belong to deleted courses
+    stale = changed + list(existing)
+    if stale:
+        db.session.execute(db.delete(RelatedCourse).where(RelatedCourse.course_id.in_(stale)))
+    if new_rows:
+        db.session.execute(db.insert(RelatedCourse), new_rows)
+    db.session.commit()
+    if stale:
+        catalog_cache.bump()
+    return len(courses), len(changed)
+
+@api.cli.command('update-related-courses')
+def update_related_courses_command():
+    """Recompute co-viewed related courses, falling back to category for cold-start courses."""
+    courses, changed = update_related_courses()
+    print(f"Computed related courses for {courses} courses, {changed} changed")
+
+# Query plan check. Replays read endpoints through the test client, runs
+# EXPLAIN on every SELECT they issue and reports full table scans. Point it
+# at a database of realistic size; it exits non-zero if any scan is found.
+QUERY_PLAN_ENDPOINTS = [
+    '/api/courses?limit=20&sort=id',
+    '/api/courses?limit=20&sort=view_count&cursor=' + encode_cursor(0, 1),
+    '/api/courses?limit=20&sort=view_count',
+    '/api/courses?limit=20&sort=popularity_score',
+    '/api/courses?limit=20&sort=created_at',
+    '/api/courses/category/Development',
+    '/api/courses/search?q=intro&limit=20',
+    '/api/courses/1/resources',
+    '/api/courses/1/related',
+    '/api/admin/dashboard',
+    '/api/admin/users?limit=20&sort=created_at',
+    '/api/auth/verify-token',
+]
+
+def find_full_scans(statement, parameters):
+    dialect = db.engine.dialect.name
+    with db.engine.connect() as connection:
+        if dialect == 'sqlite':
+            plan = [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+            # An unfiltered scan of a single table in index order stops at LIMIT, so it
+            # reads only the page it returns. Joins and subqueries are checked line by line.
+            tables_read = [line for line in plan if re.match(r'(SCAN|SEARCH) ', line)]
+            if (' LIMIT ' in statement and ' WHERE ' not in statement and ' JOIN ' not in statement
+                    and len(tables_read) == 1 and not any('TEMP B-TREE' in line for line in plan)):
+                return []
+            # Index-driven scans and FTS5 lookups report "USING ... INDEX" / "VIRTUAL TABLE INDEX"
+            scans = []
+            for line in plan:
+                match = re.match(r'SCAN (\w+)', line)
+                if match and match.group(1) in db.metadata.tables and 'INDEX' not in line:
+                    scans.append(line)
+            return scans
+        if dialect == 'postgresql':
+            plan = [row[0] for row in connection.exec_driver_sql(f"EXPLAIN {statement}", parameters)]
+            return [line.strip() for line in plan if 'Seq Scan' in line]
+    return []
+
+def query_plan_report(headers):
+    """Replay QUERY_PLAN_ENDPOINTS and yield (path, status, statement count, full scans) for each."""
+    statements = []
+    
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+    
+    client = current_app.test_client()
+    db.event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        for path in QUERY_PLAN_ENDPOINTS:
+            statements.clear()
+            status = client.get(path, headers=headers).status_code
+            scans = []
+            if status < 400:
+                for statement, parameters in list(statements):
+                    scans.extend(f"{line}\n      {' '.join(statement.split())}"
+                                 for line in find_full_scans(statement, parameters))
+            yield path, status, len(statements), scans
+    finally:
+        db.event.remove(db.engine, 'before_cursor_execute', capture)
+
+@api.cli.command('check-query-plans')
+def check_query_plans_command():
+    """EXPLAIN the queries behind the read endpoints and fail on full table scans."""
+    admin = User.query.filter_by(role='admin').order_by(User.id).first()
+    headers = {}
+    if admin:
+        token = jwt.encode({'user_id': admin.id, 'exp': datetime.utcnow() + timedelta(minutes=5)},
+                           current_app.secret_key, algorithm="HS256")
+        headers['Authorization'] = f'Bearer {token}'
+    else:
+        print("No admin user found; admin endpoints will be skipped")
+    
+    failures = 0
+    for path, status, statement_count, scans in query_plan_report(headers):
+        if status >= 400:
+            print(f"SKIP {path} (HTTP {status})")
+        elif scans:
+            failures += 1
+            print(f"FAIL {path}")
+            for scan in scans:
+                print(f"    {scan}")
+        else:
+            print(f"OK   {path} ({statement_count} queries)")
+    
+    if failures:
+        raise SystemExit(1)
+
+def init_database():
+    # Replicas get their schema through replication
+    db.create_all(bind_key=None)
+    upgrade_schema()
+    init_search_index()
+    # Seed the dashboard counters the first time this database runs with them
+    if db.session.get(DashboardStat, 'total_users') is None:
+        rebuild_dashboard_stats()
+        db.session.commit()
+        logger.info("Dashboard statistics rebuilt")
+
+@api.cli.command('init-db')
+def init_db_command():
+    """Create missing tables, columns and indexes, the search index and the dashboard counters."""
+    init_database()
+    print(f"Database is up to date (search backend: {current_app.config['SEARCH_BACKEND']})")
+
+@api.cli.command('sync-sqlite-replicas')
+def sync_sqlite_replicas_command():
+    """Copy an SQLite primary onto SQLite replica files, standing in for replication locally."""
+    if db.engine.dialect.name != 'sqlite':
+        print("The primary database is not SQLite")
+        raise SystemExit(1)
+    source = db.engine.raw_connection()
+    try:
+        for key in replica_router.bind_keys():
+            engine = db.engines[key]
+            if engine.dialect.name != 'sqlite':
+                print(f"Skipping {key}: not SQLite")
+                continue
+            try:
+                target = engine.raw_connection()
+            except Exception as e:
+                print(f"Skipping {key}: {str(e)}")
+                continue
+            try:
+                source.driver_connection.backup(target.driver_connection)
+            finally:
+                target.close()
+            print(f"Copied the primary to {key} ({engine.url.database})")
+    finally:
+        source.close()
+
+def engine_options(config):
+    options = {
+        'pool_pre_ping': True,
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    }
+    # In-memory SQLite uses a single shared connection, which takes no sizing
+    database_url = config['SQLALCHEMY_DATABASE_URI']
+    if not (database_url in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in database_url):
+        options.update({
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+        })
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    return options
+
+def use_sqlite_performance_mode(config):
+    database_url = config['SQLALCHEMY_DATABASE_URI']
+    return config['SQLITE_PERFORMANCE_MODE'] and database_url.startswith('sqlite') \
+        and 'memory' not in database_url and database_url != 'sqlite://'
+
+def sqlite_pragmas_listener(config):
+    # Connections may be opened outside an app context (pool refills), so bind the settings now
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}")
+        cursor.execute(f"PRAGMA cache_size=-{int(config['SQLITE_CACHE_SIZE_KB'])}")
+        cursor.execute(f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}")
+        cursor.close()
+    return set_sqlite_pragmas
+
+def begin_sqlite_writer_connection(dbapi_connection, connection_record):
+    # Let SQLAlchemy emit BEGIN itself instead of the sqlite3 module's deferred BEGIN
+    dbapi_connection.isolation_level = None
+
+def begin_immediate(conn):
+    # Take the write lock at the start of the transaction; a deferred transaction
+    # that upgrades to a writer fails straight away instead of waiting busy_timeout
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+def create_app(config=None):
+    """Build the Flask app: configuration, per-app services, database binding and routes.
+
+    config is a mapping or the path of a Python config file, applied over
+    the environment settings read by load_config(). Each call returns a new
+    app with its own services and engines, so tests can build one per
+    database. Startup opens no long-lived connections and doesn't touch the
+    schema (run `flask init-db`), so the app can be preloaded before forking
+    workers; pooled connections are dropped in forked children.
+    """
+    app = Flask(__name__)
+    CORS(app)  # Enable CORS for all routes
+    app.json = FastJSONProvider(app)
+    load_config(app.config)
+    if isinstance(config, str):
+        app.config.from_pyfile(config)
+    elif config:
+        app.config.update(config)
+    
+    for folder in (app.config['UPLOAD_FOLDER'], os.path.join(app.config['UPLOAD_FOLDER'], COURSE_RESOURCES_SUBFOLDER),
+                   app.config['UPLOAD_SESSIONS_FOLDER']):
+        os.makedirs(folder, exist_ok=True)
+    
+    services = app.extensions['skillversity'] = {
+        'replica_router': ReplicaRouter(app),
+        'view_counter': ViewCounterBuffer(app),
+        'activity_sink': ActivitySink(app),
+        'password_hasher': PasswordHasher(app),
+        'auth_cache': AuthCache(app),
+        'catalog_cache': CatalogCache(app),
+        'request_metrics': RequestMetrics(app),
+        'compression_cache': CompressionCache(app),
+        'trending_index': TrendingIndex(app),
+    }
+    atexit.register(services['view_counter'].stop)
+    atexit.register(services['activity_sink'].stop)
+    atexit.register(services['password_hasher'].shutdown)
+    
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    app.config['SQLALCHEMY_BINDS'] = {
+        **(app.config.get('SQLALCHEMY_BINDS') or {}),
+        **dict(zip(services['replica_router'].bind_keys(), app.config['DATABASE_REPLICA_URLS']))
+    }
+    if use_sqlite_performance_mode(app.config):
+        # One writer connection per process: concurrent writers queue for it in the pool
+        app.config['SQLALCHEMY_BINDS'][SQLITE_WRITER_BIND] = {
+            'url': app.config['SQLALCHEMY_DATABASE_URI'],
+            'pool_size': 1,
+            'max_overflow': 0,
+        }
+    db.init_app(app)
+    app.register_blueprint(api)
+    
+    with app.app_context():
+        if use_sqlite_performance_mode(app.config):
+            set_sqlite_pragmas = sqlite_pragmas_listener(app.config)
+            for key in (None, SQLITE_WRITER_BIND):
+                event.listen(db.engines[key], 'connect', set_sqlite_pragmas)
+            event.listen(db.engines[SQLITE_WRITER_BIND], 'connect', begin_sqlite_writer_connection)
+            event.listen(db.engines[SQLITE_WRITER_BIND], 'begin', begin_immediate)
+        engines = list(db.engines.values())
+    # Nothing connects while the app is built, but a process that forks after
+    # using it (e.g. a CLI command) must not share its pooled connections
+    os.register_at_fork(after_in_child=lambda: [engine.dispose(close=False) for engine in engines])
+    return app
+
+# Module-level app for `flask --app app`, `gunicorn app:app` and `python app.py`,
+# configured from the environment and, if APP_CONFIG_FILE is set, that file
+app = create_app(os.environ.get("APP_CONFIG_FILE"))
 
 if __name__ == '__main__':
+    with app.app_context():
+        init_database()
     app.run(debug=True, port=5000)
-
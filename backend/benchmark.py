@@ -0,0 +1,411 @@
+"""Load-testing benchmark for the SkillVersity API.
+
+Seeds a fresh database with a configurable dataset, serves the app on a
+local port and drives the real endpoints with concurrent clients. Reports
+p50/p95/p99 latency, requests/sec and SQL queries per request for each
+scenario, and writes the results as JSON so runs can be compared between
+versions:
+
+    python benchmark.py --users 1000 --courses 500 --output results.json
+    python benchmark.py --compare baseline.json results.json
+
+By default the database is a throwaway SQLite file; set --database-url (or
+DATABASE_URL) to benchmark against PostgreSQL. The database is seeded, so
+never point it at real data.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+SEARCH_WORDS = ('python', 'design', 'data', 'marketing', 'music', 'finance', 'cloud', 'writing')
+CATEGORIES = ('Development', 'Design', 'Business', 'Marketing', 'Music', 'Photography')
+ACTION_TYPES = ('login', 'course_view', 'enrollment', 'file_upload')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=200, help='users to seed')
+    parser.add_argument('--courses', type=int, default=200, help='courses to seed')
+    parser.add_argument('--resources', type=int, default=5, help='resources per course')
+    parser.add_argument('--activity', type=int, default=20000, help='activity log rows to seed')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=500, help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'),
+                        help='database to seed and benchmark (default: a temporary SQLite file)')
+    parser.add_argument('--output', help='write JSON results to this file (default: stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='compare two result files instead of running')
+    parser.add_argument('--startup-budget-ms', type=float,
+                        help='exit non-zero if importing the app (median of 3 runs) takes longer than this')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the dataset and request mix')
+    return parser.parse_args()
+
+# Scenarios: each builds one request (method, path, headers, body) for a client.
+# Tokens come from the context so requests measure the endpoint, not login.
+def catalog_request(ctx, rng):
+    return 'GET', '/api/courses?limit=20&sort=popularity_score&fields=id,title,author,image,rating,category', {}, None
+
+def course_detail_request(ctx, rng):
+    return 'GET', f"/api/courses/{rng.choice(ctx['course_ids'])}", {'Authorization': ctx['user_auth']}, None
+
+def search_request(ctx, rng):
+    return 'GET', f"/api/courses/search?q={rng.choice(SEARCH_WORDS)}&limit=20", {}, None
+
+def login_request(ctx, rng):
+    body = json.dumps({'email': rng.choice(ctx['emails']), 'password': BENCHMARK_PASSWORD})
+    return 'POST', '/api/auth/login', {'Content-Type': 'application/json'}, body.encode()
+
+def dashboard_request(ctx, rng):
+    return 'GET', '/api/admin/dashboard', {'Authorization': ctx['admin_auth']}, None
+
+def upload_request(ctx, rng):
+    boundary = uuid.uuid4().hex
+    content = os.urandom(ctx['upload_size'])
+    body = b''.join([
+        f'--{boundary}\r\nContent-Disposition: form-data; name="type"\r\n\r\nother\r\n'.encode(),
+        f'--{boundary}\r\nContent-Disposition: form-data; name="folder"\r\n\r\nbenchmark\r\n'.encode(),
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="bench.bin"\r\n'.encode(),
+        b'Content-Type: application/octet-stream\r\n\r\n', content, b'\r\n',
+        f'--{boundary}--\r\n'.encode()
+    ])
+    headers = {'Authorization': ctx['user_auth'], 'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    return 'POST', '/api/upload', headers, body
+
+SCENARIOS = {
+    'catalog': catalog_request,
+    'course_detail': course_detail_request,
+    'search': search_request,
+    'login': login_request,
+    'dashboard': dashboard_request,
+    'upload': upload_request,
+}
+
+def seed_dataset(app_module, args, rng):
+    """Bulk-insert the dataset and rebuild the derived tables. Returns the request context."""
+    db = app_module.db
+    now = datetime.utcnow()
+    # Every user shares one hash so seeding doesn't pay the password hashing cost per row
+    password = app_module.password_hasher.hash(BENCHMARK_PASSWORD)
+
+    users = [{
+        'email': f'bench{i}@example.com',
+        'password': password,
+        'username': f'bench{i}',
+        'role': 'admin' if i == 0 else 'user',
+        'created_at': now - timedelta(minutes=i),
+        'user_metadata': {}
+    } for i in range(max(args.users, 2))]
+    db.session.execute(db.insert(app_module.User), users)
+
+    courses = [{
+        'title': f"{rng.choice(SEARCH_WORDS).title()} {rng.choice(SEARCH_WORDS)} course {i}",
+        'description': ' '.join(rng.choice(SEARCH_WORDS) for _ in range(30)),
+        'author': f'Author {i % 50}',
+        'image': f'/uploads/course-images/{i}.jpg',
+        'rating': round(rng.uniform(3, 5), 1),
+        'duration': f'{rng.randint(1, 40)} hours',
+        'price': f'${rng.randint(0, 200)}',
+        'category': rng.choice(CATEGORIES),
+        'created_at': now - timedelta(hours=i),
+        'view_count': rng.randint(0, 10000),
+        'enrollment_count': rng.randint(0, 1000),
+        'popularity_score': rng.randint(0, 10000)
+    } for i in range(max(args.courses, 1))]
+    db.session.execute(db.insert(app_module.Course), courses)
+    course_ids = [row[0] for row in db.session.execute(db.select(app_module.Course.id))]
+
+    resources = [{
+        'course_id': course_id,
+        'name': f'lesson-{j}.pdf',
+        'type': 'pdf',
+        'url': f'/uploads/course-resources/{course_id}-{j}.pdf',
+        'size': rng.randint(10000, 5000000),
+        'created_at': now
+    } for course_id in course_ids for j in range(args.resources)]
+    if resources:
+        db.session.execute(db.insert(app_module.CourseResource), resources)
+
+    user_ids = [row[0] for row in db.session.execute(db.select(app_module.User.id))]
+    batch = []
+    for i in range(args.activity):
+        batch.append({
+            'user_id': rng.choice(user_ids),
+            'action_type': rng.choice(ACTION_TYPES),
+            'details': 'benchmark',
+            'course_id': rng.choice(course_ids),
+            'created_at': now - timedelta(seconds=rng.randint(0, 90 * 24 * 3600))
+        })
+        if len(batch) == 5000:
+            db.session.execute(db.insert(app_module.ActivityLog), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(app_module.ActivityLog), batch)
+
+    app_module.rebuild_dashboard_stats()
+    db.session.commit()
+    # Postgres indexes search on its own; only the SQLite FTS5 table needs filling
+    if app_module.search_backend() == 'fts5':
+        app_module.rebuild_search_index()
+        db.session.commit()
+
+    emails = [user['email'] for user in users]
+    return {'course_ids': course_ids, 'emails': emails}
+
+class LocalServer:
+    """Serves the app with the threaded werkzeug server on a free local port."""
+    def __init__(self, flask_app):
+        from werkzeug.serving import make_server
+        self.server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+
+class Client:
+    """One keep-alive HTTP connection per benchmark client thread."""
+    def __init__(self, port):
+        self.port = port
+        self.connection = None
+
+    def request(self, method, path, headers, body):
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                payload = response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    self.close()
+                return response.status, payload
+            except (http.client.HTTPException, ConnectionError):
+                # The dev server may drop idle connections; retry once on a fresh one
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def run_scenario(name, build_request, ctx, args, query_counter):
+    """Run one scenario with args.concurrency clients and return its result dict."""
+    seeds = random.Random(f'{args.seed}:{name}')
+    clients = [Client(ctx['port']) for _ in range(args.concurrency)]
+    client_rngs = [random.Random(seeds.random()) for _ in clients]
+
+    def worker(index, count, record):
+        client, rng = clients[index], client_rngs[index]
+        samples, statuses = [], {}
+        for _ in range(count):
+            method, path, headers, body = build_request(ctx, rng)
+            started = time.perf_counter()
+            try:
+                status, _ = client.request(method, path, headers, body)
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            if record:
+                samples.append(elapsed)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return samples, statuses
+
+    def run_all(total, record):
+        shares = [total // args.concurrency + (1 if i < total % args.concurrency else 0)
+                  for i in range(args.concurrency)]
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            return list(pool.map(lambda i: worker(i, shares[i], record), range(args.concurrency)))
+
+    run_all(args.warmup, False)
+    queries_before = query_counter['count']
+    started = time.perf_counter()
+    results = run_all(args.requests, True)
+    wall_time = time.perf_counter() - started
+    queries = query_counter['count'] - queries_before
+    for client in clients:
+        client.close()
+
+    latencies = sorted(sample for samples, _ in results for sample in samples)
+    statuses = {}
+    for _, counts in results:
+        for status, count in counts.items():
+            statuses[status] = statuses.get(status, 0) + count
+    errors = sum(count for status, count in statuses.items() if not (status.isdigit() and int(status) < 400))
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'status_codes': statuses,
+        'wall_time_s': round(wall_time, 3),
+        'requests_per_sec': round(len(latencies) / wall_time, 1) if wall_time else 0,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0,
+            'p50': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99': round(percentile(latencies, 0.99) * 1000, 2),
+            'max': round(latencies[-1] * 1000, 2) if latencies else 0
+        },
+        # Includes statements issued by the background view counter and activity log writers
+        'queries_per_request': round(queries / len(latencies), 2) if latencies else 0
+    }
+
+def measure_startup(runs=3):
+    """Median time to import and configure the app in a fresh interpreter, in milliseconds."""
+    code = 'import time; started = time.perf_counter(); import app; print(time.perf_counter() - started)'
+    env = dict(os.environ, LOG_LEVEL='WARNING')
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        timings.append(float(result.stdout.strip().splitlines()[-1]) * 1000)
+    return round(sorted(timings)[len(timings) // 2], 1)
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(baseline_path, current_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+
+    print(f"{'scenario':<15}{'req/s':>22}{'p50 ms':>22}{'p95 ms':>22}{'queries/req':>18}")
+    for name, result in current['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        columns = []
+        for key, value in (('requests_per_sec', lambda r: r['requests_per_sec']),
+                           ('p50', lambda r: r['latency_ms']['p50']),
+                           ('p95', lambda r: r['latency_ms']['p95'])):
+            old, new = value(before), value(result)
+            change = f"{(new - old) / old * 100:+.0f}%" if old else 'n/a'
+            columns.append(f"{old:>8} -> {new:<8}{change:>5}")
+        columns.append(f"{before['queries_per_request']:>6} -> {result['queries_per_request']:<6}")
+        print(f"{name:<15}" + ''.join(f"{column:>22}" for column in columns))
+
+def main():
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    scenario_names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenario_names if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Unknown scenario(s): {', '.join(unknown)}")
+
+    workdir = tempfile.mkdtemp(prefix='skillversity-benchmark-')
+    # The app reads its configuration at import time, so set it up first
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    os.environ.setdefault('FLASK_ENV', 'production')
+    logging.basicConfig(level=logging.WARNING)
+    import app as app_module
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app_module.app.config['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+
+    rng = random.Random(args.seed)
+    with app_module.app.app_context():
+        app_module.init_database()
+        started = time.perf_counter()
+        ctx = seed_dataset(app_module, args, rng)
+        seed_time = time.perf_counter() - started
+
+        query_counter = {'count': 0}
+        counter_lock = threading.Lock()
+        def count_query(*_):
+            with counter_lock:
+                query_counter['count'] += 1
+        # Count statements on every bind (replicas, the SQLite writer), not just the primary
+        for engine in app_module.db.engines.values():
+            app_module.db.event.listen(engine, 'before_cursor_execute', count_query)
+
+    # Measured after seeding, so startup sees a populated database
+    startup_ms = measure_startup()
+    print(f"Startup: {startup_ms} ms", file=sys.stderr)
+
+    results = {}
+    with LocalServer(app_module.app) as server:
+        ctx['port'] = server.port
+        ctx['upload_size'] = 256 * 1024
+        client = Client(server.port)
+        for key, email in (('admin_auth', ctx['emails'][0]), ('user_auth', ctx['emails'][1])):
+            _, payload = client.request(*login_request({'emails': [email]}, rng))
+            ctx[key] = 'Bearer ' + json.loads(payload)['token']
+        client.close()
+
+        for name in scenario_names:
+            print(f"Running {name} ...", file=sys.stderr)
+            results[name] = run_scenario(name, SCENARIOS[name], ctx, args, query_counter)
+            summary = results[name]
+            print(f"  {summary['requests_per_sec']} req/s, p50 {summary['latency_ms']['p50']} ms, "
+                  f"p95 {summary['latency_ms']['p95']} ms, p99 {summary['latency_ms']['p99']} ms, "
+                  f"{summary['queries_per_request']} queries/req, {summary['errors']} errors", file=sys.stderr)
+
+    report = {
+        'created_at': datetime.utcnow().isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'database': app_module.db.engine.dialect.name if args.database_url else 'sqlite (temporary)',
+        'dataset': {
+            'users': max(args.users, 2),
+            'courses': max(args.courses, 1),
+            'resources_per_course': args.resources,
+            'activity_rows': args.activity,
+            'seed_time_s': round(seed_time, 2)
+        },
+        'startup_ms': startup_ms,
+        'concurrency': args.concurrency,
+        'requests_per_scenario': args.requests,
+        'scenarios': results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    # Write buffered view counts and activity events while the database still exists
+    with app_module.app.app_context():
+        app_module.view_counter.stop()
+        app_module.activity_sink.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.startup_budget_ms is not None and startup_ms > args.startup_budget_ms:
+        sys.exit(f"Startup took {startup_ms} ms, over the {args.startup_budget_ms} ms budget")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import event
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Importing the app module builds the module-level app from the environment;
+# keep it off the development database and upload folders
+MODULE_APP_DIR = tempfile.mkdtemp(prefix='skillversity-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(MODULE_APP_DIR, 'module.db')}"
+os.environ['UPLOAD_FOLDER'] = os.path.join(MODULE_APP_DIR, 'uploads')
+os.environ['UPLOAD_SESSIONS_FOLDER'] = os.path.join(MODULE_APP_DIR, 'upload-sessions')
+
+import app as app_module  # noqa: E402
+
+
+def app_config(tmp_path, **overrides):
+    config = {
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'UPLOAD_SESSIONS_FOLDER': str(tmp_path / 'upload-sessions'),
+        'ACTIVITY_ARCHIVE_FOLDER': str(tmp_path / 'activity-archive'),
+        # Deterministic writes and cheap password hashes
+        'ACTIVITY_LOG_SYNC': True,
+        'VIEW_COUNT_FLUSH_INTERVAL': 0,
+        'PASSWORD_HASH_WORKERS': 0,
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        'CATALOG_CACHE_TTL': 0,
+    }
+    config.update(overrides)
+    return config
+
+
+@pytest.fixture
+def app(tmp_path):
+    test_app = app_module.create_app(app_config(tmp_path))
+    with test_app.app_context():
+        app_module.init_database()
+    yield test_app
+    with test_app.app_context():
+        app_module.db.session.remove()
+        for engine in app_module.db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def query_counter(app):
+    """Counts SQL statements run on any of the app's engines."""
+    counter = {'count': 0}
+
+    def count(*_):
+        counter['count'] += 1
+
+    with app.app_context():
+        engines = list(app_module.db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', count)
+    yield counter
+    for engine in engines:
+        event.remove(engine, 'before_cursor_execute', count)
+
+
+@pytest.fixture
+def auth_headers(app, client):
+    """Returns a function that registers a user with a role and gives its Authorization header."""
+    def make(email, role='user'):
+        client.post('/api/auth/register', json={'email': email, 'password': 'password',
+                                                'username': email.split('@')[0]})
+        if role != 'user':
+            with app.app_context():
+                user = app_module.User.query.filter_by(email=email).one()
+                user.role = role
+                app_module.db.session.commit()
+        token = client.post('/api/auth/login', json={'email': email, 'password': 'password'}).get_json()['token']
+        return {'Authorization': f'Bearer {token}'}
+    return make
@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta
+
+import app as app_module
+
+
+def test_rollups_survive_archiving_a_backlog(app):
+    # One event a day for 200 closed days: more than retention + max_days behind
+    today = datetime.utcnow().date()
+    days = [today - timedelta(days=offset) for offset in range(1, 201)]
+    app.config['ACTIVITY_RETENTION_DAYS'] = 90
+
+    with app.app_context():
+        db = app_module.db
+        db.session.add_all([
+            app_module.ActivityLog(action_type='login', created_at=datetime.combine(day, datetime.min.time()) + timedelta(hours=12))
+            for day in days
+        ])
+        db.session.commit()
+
+        archived_rows = 0
+        for _ in range(10):
+            app_module.rollup_activity(31)
+            archived_rows += sum(app_module.archive_activity(31).values())
+            rolled_up = db.session.query(db.func.sum(app_module.ActivityRollup.count)).scalar() or 0
+            # Every archived event stays counted in a rollup
+            assert rolled_up >= archived_rows
+
+        rollups = dict(db.session.query(app_module.ActivityRollup.day, app_module.ActivityRollup.count))
+        remaining_rows = app_module.ActivityLog.query.count()
+
+    assert archived_rows == 200 - 90
+    assert archived_rows + remaining_rows == 200
+    assert rollups == {day: 1 for day in days}
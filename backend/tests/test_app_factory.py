@@ -0,0 +1,75 @@
+import os
+
+from sqlalchemy import inspect
+
+import app as app_module
+from benchmark import measure_startup
+from conftest import app_config
+
+# Importing the app (Flask, SQLAlchemy and the factory) must stay cheap enough
+# for workers to boot quickly; override on slow CI machines
+STARTUP_BUDGET_MS = float(os.environ.get('STARTUP_BUDGET_MS', '2000'))
+
+
+def test_import_within_startup_budget(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'startup.db'}")
+    monkeypatch.setenv('UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setenv('UPLOAD_SESSIONS_FOLDER', str(tmp_path / 'upload-sessions'))
+    startup_ms = measure_startup()
+    assert startup_ms <= STARTUP_BUDGET_MS, f"importing the app took {startup_ms} ms"
+
+
+def test_create_app_binds_its_own_database(tmp_path):
+    first = app_module.create_app(app_config(tmp_path / 'first'))
+    second = app_module.create_app(app_config(tmp_path / 'second'))
+    for flask_app in (first, second):
+        with flask_app.app_context():
+            app_module.init_database()
+
+    with second.app_context():
+        app_module.db.session.add(app_module.Course(title='Only in second', author='Ann'))
+        app_module.db.session.commit()
+
+    assert first.test_client().get('/api/courses').get_json() == []
+    assert [course['title'] for course in second.test_client().get('/api/courses').get_json()] == ['Only in second']
+    assert first.extensions['skillversity']['catalog_cache'] is not second.extensions['skillversity']['catalog_cache']
+
+
+def test_create_app_leaves_schema_and_connections_alone(tmp_path):
+    flask_app = app_module.create_app(app_config(tmp_path))
+    with flask_app.app_context():
+        engine = app_module.db.engine
+        # Nothing pooled for a prefork server to hand to its workers
+        assert engine.pool.checkedin() == 0
+        assert engine.pool.checkedout() == 0
+        # Schema changes only happen in `flask init-db`
+        assert inspect(engine).get_table_names() == []
+
+
+def test_engine_pool_settings_come_from_config(tmp_path):
+    flask_app = app_module.create_app(app_config(tmp_path, DB_POOL_SIZE=3, DB_MAX_OVERFLOW=1, DB_POOL_TIMEOUT=7))
+    with flask_app.app_context():
+        pool = app_module.db.engine.pool
+    assert pool.size() == 3
+    assert pool._max_overflow == 1
+    assert pool._timeout == 7
+
+
+def test_search_index_created_after_startup_is_kept_in_sync(tmp_path):
+    flask_app = app_module.create_app(app_config(tmp_path))
+    client = flask_app.test_client()
+    with flask_app.app_context():
+        app_module.db.create_all(bind_key=None)
+        assert app_module.search_backend() == 'like'
+        # `flask init-db` run by another process after this worker started
+        app_module.init_search_index()
+        flask_app.config['SEARCH_BACKEND'] = 'like'
+
+        course = app_module.Course(title='Kubernetes in depth', author='Ann')
+        app_module.db.session.add(course)
+        app_module.db.session.flush()
+        app_module.index_course(course)
+        app_module.db.session.commit()
+
+    assert [course['title'] for course in client.get('/api/courses/search?q=kubernetes').get_json()] == ['Kubernetes in depth']
+    assert flask_app.config['SEARCH_BACKEND'] == 'fts5'
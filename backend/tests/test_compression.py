@@ -0,0 +1,39 @@
+import gzip
+import json
+
+import app as app_module
+
+
+def add_catalog(app):
+    with app.app_context():
+        app_module.db.session.add_all([
+            app_module.Course(title=f'Course {number}', description='A long enough description ' * 5, author='Ann')
+            for number in range(20)
+        ])
+        app_module.db.session.commit()
+
+
+def test_each_encoding_gets_its_own_strong_etag(app, client):
+    add_catalog(app)
+
+    plain = client.get('/api/courses', headers={'Accept-Encoding': 'identity'})
+    compressed = client.get('/api/courses', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in plain.headers
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(compressed.data)) == plain.get_json()
+
+    plain_etag, plain_weak = plain.get_etag()
+    gzip_etag, gzip_weak = compressed.get_etag()
+    assert not plain_weak and not gzip_weak
+    assert gzip_etag == f'{plain_etag}-gzip'
+    assert 'Accept-Encoding' in compressed.vary
+
+    # Revalidation answers with the same ETag the 200 carried
+    not_modified = client.get('/api/courses', headers={'Accept-Encoding': 'gzip', 'If-None-Match': f'"{gzip_etag}"'})
+    assert not_modified.status_code == 304
+    assert not_modified.get_etag() == (gzip_etag, False)
+    # The gzip body's ETag doesn't validate the uncompressed body
+    assert client.get('/api/courses', headers={'Accept-Encoding': 'identity',
+                                               'If-None-Match': f'"{gzip_etag}"'}).status_code == 200
+    assert client.get('/api/courses', headers={'Accept-Encoding': 'identity',
+                                               'If-None-Match': f'"{plain_etag}"'}).status_code == 304
@@ -0,0 +1,62 @@
+import pytest
+
+import app as app_module
+
+CATEGORY = 'Programming'
+
+# Catalog endpoints must run a fixed number of statements however many courses
+# they return; a query per course (N+1) makes the counts below diverge
+ENDPOINTS = [
+    ('/api/courses', False),
+    (f'/api/courses/category/{CATEGORY}', False),
+    ('/api/courses/search?q=python', False),
+    ('/api/admin/dashboard', True),
+]
+
+
+def add_courses(count, admin_id):
+    db = app_module.db
+    for _ in range(count):
+        course = app_module.Course(title='Python basics', description='Learn Python', author='Ann',
+                                   category=CATEGORY)
+        course.resources = [
+            app_module.CourseResource(name=f'Lesson {number}', type='video', url=f'/uploads/lesson-{number}.mp4')
+            for number in range(2)
+        ]
+        db.session.add(course)
+        db.session.flush()
+        db.session.add(app_module.ActivityLog(user_id=admin_id, action_type='course_view',
+                                              details=f"User viewed course: {course.title}", course_id=course.id))
+    db.session.commit()
+    app_module.rebuild_dashboard_stats()
+    if app_module.search_backend() == 'fts5':
+        app_module.rebuild_search_index()
+    db.session.commit()
+
+
+def count_queries(client, query_counter, url, headers):
+    # Warm up first so per-process caches (auth, trending) don't skew the count
+    assert client.get(url, headers=headers).status_code == 200
+    query_counter['count'] = 0
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    return query_counter['count'], response.get_json()
+
+
+@pytest.mark.parametrize('url, admin_only', ENDPOINTS)
+def test_query_count_does_not_grow_with_courses(app, client, query_counter, auth_headers, url, admin_only):
+    headers = auth_headers('admin@example.com', role='admin') if admin_only else {}
+    # Seed in a separate app context so requests don't share the seeding session
+    with app.app_context():
+        admin_id = app_module.User.query.filter_by(email='admin@example.com').one().id if admin_only else None
+        add_courses(3, admin_id)
+    few_queries, few = count_queries(client, query_counter, url, headers)
+
+    with app.app_context():
+        add_courses(27, admin_id)
+    many_queries, many = count_queries(client, query_counter, url, headers)
+
+    if not admin_only:
+        assert (len(few), len(many)) == (3, 30)
+        assert all(len(course['resources']) == 2 for course in many)
+    assert few_queries == many_queries
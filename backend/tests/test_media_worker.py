@@ -0,0 +1,78 @@
+import io
+import os
+
+from PIL import Image
+
+import app as app_module
+
+
+def add_resource(course, name, file_type, content):
+    path = os.path.join(app_module.current_app.config['UPLOAD_FOLDER'], 'general', name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as media_file:
+        media_file.write(content)
+    resource = app_module.CourseResource(course_id=course.id, name=name, type=file_type,
+                                         url=f'/uploads/general/{name}', size=len(content), processing_status='pending')
+    app_module.db.session.add(resource)
+    app_module.db.session.flush()
+    app_module.db.session.add(app_module.MediaJob(resource_id=resource.id))
+    return resource
+
+
+def png_bytes(width, height):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), 'teal').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def test_dead_worker_process_only_charges_its_own_job(app, tmp_path, monkeypatch):
+    # An "ffmpeg" that kills the worker process running it, like the OOM killer would
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    (bin_dir / 'ffmpeg').write_text('#!/bin/sh\nkill -9 $PPID\n')
+    (bin_dir / 'ffmpeg').chmod(0o755)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    with app.app_context():
+        course = app_module.Course(title='Media', author='Ann')
+        app_module.db.session.add(course)
+        app_module.db.session.flush()
+        # With one process the image waits behind the video and dies with the pool
+        video = add_resource(course, 'crash.mp4', 'video', b'not really a video')
+        image = add_resource(course, 'cover.png', 'image', png_bytes(400, 300))
+        app_module.db.session.commit()
+
+        pool = app_module.MediaWorkerPool(1)
+        try:
+            assert app_module.run_media_jobs(pool, limit=2) == 2
+            assert pool.restarts == 1
+            # The new pool works
+            assert pool.executor.submit(os.getpid).result() != os.getpid()
+        finally:
+            pool.shutdown()
+
+        jobs = {job.resource_id: job for job in app_module.MediaJob.query}
+        assert (jobs[image.id].status, jobs[image.id].attempts) == ('done', 1)
+        assert (jobs[video.id].status, jobs[video.id].attempts) == ('pending', 1)
+        assert 'died' in jobs[video.id].error
+
+
+def test_images_over_the_pixel_limit_are_not_decoded(app):
+    app.config['MEDIA_MAX_IMAGE_PIXELS'] = 100 * 100
+    with app.app_context():
+        course = app_module.Course(title='Media', author='Ann')
+        app_module.db.session.add(course)
+        app_module.db.session.flush()
+        image = add_resource(course, 'huge.png', 'image', png_bytes(200, 200))
+        app_module.db.session.commit()
+
+        pool = app_module.MediaWorkerPool(1)
+        try:
+            app_module.run_media_jobs(pool, limit=1)
+        finally:
+            pool.shutdown()
+
+        job = app_module.MediaJob.query.filter_by(resource_id=image.id).one()
+        assert job.status == 'pending'
+        assert 'pixels' in job.error
+        assert app_module.db.session.get(app_module.CourseResource, image.id).derivatives is None
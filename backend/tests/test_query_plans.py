@@ -0,0 +1,35 @@
+import random
+from argparse import Namespace
+
+import pytest
+
+import app as app_module
+from benchmark import seed_dataset
+
+
+@pytest.fixture
+def seeded_app(app):
+    # Enough rows that SQLite's planner prefers indexes where it has them
+    with app.app_context():
+        seed_dataset(app_module, Namespace(users=300, courses=300, resources=2, activity=3000), random.Random(7))
+        app_module.db.session.remove()
+    return app
+
+
+def test_read_endpoints_have_no_full_table_scans(seeded_app, auth_headers):
+    headers = auth_headers('planner@example.com', role='admin')
+    with seeded_app.app_context():
+        report = list(app_module.query_plan_report(headers))
+
+    assert [(path, status) for path, status, _, _ in report if status >= 400] == []
+    assert {path: scans for path, _, _, scans in report if scans} == {}
+
+
+def test_limit_exemption_only_covers_single_table_plans(seeded_app):
+    with seeded_app.app_context():
+        # Reads one page of the table in primary key order
+        assert app_module.find_full_scans('SELECT id FROM course ORDER BY id LIMIT 20', ()) == []
+        # The LIMIT doesn't bound the unindexed join side, which is read in full
+        joined = app_module.find_full_scans(
+            'SELECT course.id FROM course JOIN course_resource ON course_resource.name = course.title LIMIT 20', ())
+        assert joined
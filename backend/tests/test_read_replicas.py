@@ -0,0 +1,24 @@
+import app as app_module
+from conftest import app_config
+
+
+def test_replica_query_errors_fall_back_to_the_primary(tmp_path):
+    # The replica file exists but has no schema, like a replica not synced yet
+    replica_url = f"sqlite:///{tmp_path / 'replica.db'}"
+    flask_app = app_module.create_app(app_config(tmp_path, DATABASE_REPLICA_URLS=[replica_url]))
+    with flask_app.app_context():
+        app_module.init_database()
+        app_module.db.session.add(app_module.Course(title='On the primary', author='Ann'))
+        app_module.db.session.commit()
+
+    client = flask_app.test_client()
+    response = client.get('/api/courses')
+    assert response.status_code == 200
+    assert [course['title'] for course in response.get_json()] == ['On the primary']
+
+    stats = flask_app.extensions['skillversity']['replica_router'].stats()
+    assert stats['unavailable'] == ['replica_0']
+    assert stats['fallbacks'] == 1
+    # The replica stays out of rotation for the following requests
+    assert client.get('/api/courses/search?q=primary').status_code == 200
+    assert flask_app.extensions['skillversity']['replica_router'].stats()['replica_reads'] == 1
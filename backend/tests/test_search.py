@@ -0,0 +1,34 @@
+import app as app_module
+
+
+def add_courses(app, count):
+    with app.app_context():
+        for number in range(count):
+            course = app_module.Course(title=f'Python part {number}', author='Ann')
+            app_module.db.session.add(course)
+            app_module.db.session.flush()
+            app_module.index_course(course)
+        app_module.db.session.commit()
+
+
+def test_search_pages_through_all_results(app, client):
+    add_courses(app, 5)
+    titles = []
+    url = '/api/courses/search?q=python&limit=2'
+    while url:
+        page = client.get(url).get_json()
+        titles.extend(course['title'] for course in page['items'])
+        url = f"/api/courses/search?q=python&limit=2&cursor={page['next_cursor']}" if page['has_more'] else None
+    assert sorted(titles) == [f'Python part {number}' for number in range(5)]
+
+
+def test_search_and_keyset_cursors_are_not_interchangeable(app, client):
+    add_courses(app, 5)
+    keyset_cursor = app_module.encode_cursor(5, 5)
+    offset_cursor = app_module.encode_offset_cursor(2)
+
+    response = client.get(f'/api/courses/search?q=python&limit=2&cursor={keyset_cursor}')
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Invalid cursor'
+    assert client.get(f'/api/courses?limit=2&cursor={offset_cursor}').status_code == 400
+    assert client.get(f'/api/courses/search?q=python&limit=2&cursor={offset_cursor}').status_code == 200
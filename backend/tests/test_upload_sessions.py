@@ -0,0 +1,90 @@
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+import app as app_module
+
+CONTENT = b'lesson video bytes' * 100
+
+
+@pytest.fixture
+def course_id(app):
+    with app.app_context():
+        course = app_module.Course(title='Uploads', author='Ann')
+        app_module.db.session.add(course)
+        app_module.db.session.commit()
+        return course.id
+
+
+def start_upload(client, headers, course_id):
+    response = client.post('/api/uploads/sessions', headers=headers, json={
+        'fileName': 'lesson.mp4', 'size': len(CONTENT), 'chunkSize': 1000, 'type': 'video',
+        'course_id': course_id, 'checksum': hashlib.sha256(CONTENT).hexdigest()})
+    assert response.status_code == 201
+    session = response.get_json()
+    for index in range(0, len(CONTENT), 1000):
+        assert client.put(f"/api/uploads/sessions/{session['sessionId']}/chunks/{index // 1000}", headers=headers,
+                          data=CONTENT[index:index + 1000]).status_code == 200
+    return session['sessionId']
+
+
+def test_failed_completion_keeps_chunks_for_a_retry(app, client, auth_headers, course_id):
+    headers = auth_headers('uploader@example.com')
+    session_id = start_upload(client, headers, course_id)
+
+    def fail_resource_insert(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT INTO course_resource'):
+            raise RuntimeError('insert failed')
+
+    with app.app_context():
+        engine = app_module.db.engine
+    event.listen(engine, 'before_cursor_execute', fail_resource_insert)
+    try:
+        assert client.post(f'/api/uploads/sessions/{session_id}/complete', headers=headers).status_code == 500
+    finally:
+        event.remove(engine, 'before_cursor_execute', fail_resource_insert)
+
+    status = client.get(f'/api/uploads/sessions/{session_id}', headers=headers).get_json()
+    assert status['status'] == 'open'
+    assert status['missingChunks'] == []
+
+    response = client.post(f'/api/uploads/sessions/{session_id}/complete', headers=headers)
+    assert response.status_code == 201
+    with app.app_context():
+        resources = app_module.CourseResource.query.filter_by(course_id=course_id).all()
+        assert [resource.size for resource in resources] == [len(CONTENT)]
+        assert app_module.db.session.get(app_module.UploadSession, session_id).status == 'complete'
+        assert not os.path.exists(os.path.join(app.config['UPLOAD_SESSIONS_FOLDER'], session_id))
+
+
+def test_open_sessions_per_user_are_limited(app, client, auth_headers, course_id):
+    app.config['UPLOAD_MAX_OPEN_SESSIONS'] = 2
+    headers = auth_headers('uploader@example.com')
+    body = {'fileName': 'notes.pdf', 'size': 10}
+    assert client.post('/api/uploads/sessions', headers=headers, json=body).status_code == 201
+    assert client.post('/api/uploads/sessions', headers=headers, json=body).status_code == 201
+    assert client.post('/api/uploads/sessions', headers=headers, json=body).status_code == 429
+
+
+def test_abandoned_sessions_expire(app, client, auth_headers, course_id):
+    headers = auth_headers('uploader@example.com')
+    abandoned = start_upload(client, headers, course_id)
+    active = start_upload(client, headers, course_id)
+
+    with app.app_context():
+        for session_id in (abandoned, active):
+            app_module.db.session.get(app_module.UploadSession, session_id).created_at -= timedelta(days=2)
+        app_module.db.session.commit()
+        # The abandoned session's last chunk arrived two days ago
+        staging = os.path.join(app.config['UPLOAD_SESSIONS_FOLDER'], abandoned)
+        stale = (datetime.now() - timedelta(days=2)).timestamp()
+        for name in os.listdir(staging):
+            os.utime(os.path.join(staging, name), (stale, stale))
+
+        assert app_module.expire_upload_sessions() == (1, len(CONTENT))
+        assert app_module.db.session.get(app_module.UploadSession, abandoned) is None
+        assert app_module.db.session.get(app_module.UploadSession, active).status == 'open'
+    assert not os.path.exists(staging)